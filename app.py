@@ -6,7 +6,10 @@ from controllers.log_controller import register_log_routes
 from controllers.test_controller import register_test_routes
 from controllers.gitlab_controller import register_gitlab_routes
 from controllers.github_controller import register_github_routes
-from scheduler.task_scheduler import update_scheduler
+from controllers.scheduler_controller import register_scheduler_routes
+from controllers.delivery_controller import register_delivery_routes
+from scheduler.task_scheduler import update_scheduler, register_maintenance_jobs, start_cluster
+from services.delivery_queue import delivery_queue
 
 from utils.init import log_init, start_init
 
@@ -18,6 +21,8 @@ register_log_routes(app)
 register_test_routes(app)
 register_gitlab_routes(app)
 register_github_routes(app)
+register_scheduler_routes(app)
+register_delivery_routes(app)
 
 # 主页路由
 @app.route('/')
@@ -32,7 +37,10 @@ def send_static(path):
 # 主函数
 if __name__ == '__main__':
     init_db()
+    start_cluster()
+    delivery_queue.recover(include_own=True)
     update_scheduler()
+    register_maintenance_jobs()
     log_init()
     start_init()
     app.run(host='0.0.0.0', port=9096, debug=False)
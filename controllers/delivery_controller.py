@@ -0,0 +1,46 @@
+from flask import jsonify, request
+from services.feishu_service import feishu_session
+from services.delivery_queue import delivery_queue
+from services.rate_limiter import webhook_rate_limiter
+from services.outbox import outbox
+from services.event_coalescer import event_coalescer
+from utils.logger import logger
+
+def register_delivery_routes(app):
+    """注册消息发送相关路由"""
+    
+    @app.route('/api/delivery/stats', methods=['GET'])
+    def delivery_stats():
+        """获取飞书消息发送连接池、发送队列、outbox、各webhook限流和Git事件合并统计"""
+        try:
+            return jsonify({'success': True, 'stats': {
+                'session': feishu_session.stats(),
+                'queue': delivery_queue.stats(),
+                'rate_limit': webhook_rate_limiter.stats(),
+                'outbox': outbox.counts(),
+                'coalescer': event_coalescer.stats(),
+            }})
+        except Exception as e:
+            logger.error(f"获取消息发送统计失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'获取消息发送统计失败: {str(e)}'})
+
+    @app.route('/api/delivery/dead_letters', methods=['GET'])
+    def dead_letters():
+        """获取最近的死信消息（多次发送失败后不再重试的消息）"""
+        try:
+            limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+            return jsonify({'success': True, 'messages': outbox.dead_letters(limit)})
+        except Exception as e:
+            logger.error(f"获取死信消息失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'获取死信消息失败: {str(e)}'})
+    
+    @app.route('/api/delivery/dead_letters/<message_id>/retry', methods=['POST'])
+    def retry_dead_letter(message_id):
+        """重新发送一条死信消息"""
+        try:
+            if not delivery_queue.retry_dead_letter(message_id):
+                return jsonify({'success': False, 'message': '消息不存在或不是死信'}), 404
+            return jsonify({'success': True, 'message': '消息已重新放入发送队列'})
+        except Exception as e:
+            logger.error(f"重发死信消息失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'重发死信消息失败: {str(e)}'})
@@ -1,10 +1,22 @@
 from flask import request, jsonify
 from services.github_service import verify_github_signature, parse_github_event
-from services.feishu_service import send_feishu_message
-from models.db import execute_query
+from services.event_coalescer import event_coalescer
+from services.log_service import add_log
+from services.task_service import get_enabled_tasks
 from datetime import datetime
 from utils.logger import logger
 
+def _log_delivery(task_id, event_type, event_count=1):
+    """生成记录GitHub事件消息发送结果的回调，event_count为合并发送的事件数"""
+    merged = f"（合并 {event_count} 个事件）" if event_count > 1 else ""
+    def callback(send_success, send_message, elapsed):
+        add_log(
+            task_id,
+            "成功" if send_success else "失败",
+            f"GitHub事件处理: {event_type}{merged}" if send_success else f"GitHub事件处理失败{merged}: {send_message}"
+        )
+    return callback
+
 def register_github_routes(app):
     """注册GitHub相关路由"""
     
@@ -34,12 +46,17 @@ def register_github_routes(app):
         logger.info(f"GitHub项目路径: {project_path}")
         
         # 查询所有启用的GitHub任务
-        tasks = execute_query("SELECT id, name, type, webhook_url, enabled, github_token, github_events, github_project, days_of_week FROM tasks WHERE type = 'github' AND enabled = 1")
+        tasks = get_enabled_tasks('github')
         logger.info(f"找到 {len(tasks)} 个启用的GitHub任务")
         
+        # 同一个事件只解析一次，发送到各个飞书群的消息都放入发送队列，请求不等待发送完成
+        parsed = None
+        queued = 0
+        
         # 遍历所有匹配的任务
         for task in tasks:
-            task_id, name, type, feishu_webhook, enabled, github_token, github_events, github_project, days_of_week = task
+            task_id, days_of_week = task.id, task.days_of_week
+            github_token, github_events, github_project = task.github_token, task.github_events, task.github_project
             
             # 检查项目是否匹配
             if github_project and project_path != github_project:
@@ -67,17 +84,17 @@ def register_github_routes(app):
                     continue
             
             # 解析GitHub事件
-            message, success = parse_github_event(event_type, event_data)
+            if parsed is None:
+                parsed = parse_github_event(event_type, event_data)
+            message, success = parsed
             
             if success:
-                # 发送飞书消息
-                send_success, send_message = send_feishu_message(feishu_webhook, message)
-                
-                # 记录日志
-                execute_query(
-                    "INSERT INTO logs (task_id, status, message) VALUES (?, ?, ?)",
-                    (task_id, "成功" if send_success else "失败", f"GitHub事件处理: {event_type}" if send_success else f"GitHub事件处理失败: {send_message}"),
-                    commit=True
+                # 发送飞书消息（开启合并窗口的任务会先缓存推送事件），发送完成后记录日志
+                event_coalescer.submit(
+                    task, 'github', event_type, event_data, message,
+                    lambda event_count, task_id=task_id: _log_delivery(task_id, event_type, event_count)
                 )
+                queued += 1
         
+        logger.info(f"GitHub事件已放入发送队列: {queued} 条消息")
         return jsonify({'success': True, 'message': 'GitHub Webhook已处理'})
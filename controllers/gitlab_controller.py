@@ -1,10 +1,22 @@
 from flask import request, jsonify
 from services.gitlab_service import verify_gitlab_signature, parse_gitlab_event
-from services.feishu_service import send_feishu_message
-from models.db import execute_query
+from services.event_coalescer import event_coalescer
+from services.log_service import add_log
+from services.task_service import get_enabled_tasks
 from datetime import datetime
 from utils.logger import logger
 
+def _log_delivery(task_id, event_type, event_count=1):
+    """生成记录GitLab事件消息发送结果的回调，event_count为合并发送的事件数"""
+    merged = f"（合并 {event_count} 个事件）" if event_count > 1 else ""
+    def callback(send_success, send_message, elapsed):
+        add_log(
+            task_id,
+            "成功" if send_success else "失败",
+            f"GitLab事件处理: {event_type}{merged}" if send_success else f"GitLab事件处理失败{merged}: {send_message}"
+        )
+    return callback
+
 def register_gitlab_routes(app):
     """注册GitLab相关路由"""
     
@@ -34,12 +46,17 @@ def register_gitlab_routes(app):
         logger.info(f"GitLab项目路径: {project_path}")
         
         # 查询所有启用的GitLab任务
-        tasks = execute_query("SELECT id, name, type, webhook_url, enabled, gitlab_token, gitlab_events, gitlab_project, days_of_week FROM tasks WHERE type = 'gitlab' AND enabled = 1")
+        tasks = get_enabled_tasks('gitlab')
         logger.info(f"找到 {len(tasks)} 个启用的GitLab任务")
         
+        # 同一个事件只解析一次，发送到各个飞书群的消息都放入发送队列，请求不等待发送完成
+        parsed = None
+        queued = 0
+        
         # 遍历所有匹配的任务
         for task in tasks:
-            task_id, name, type, feishu_webhook, enabled, gitlab_token, gitlab_events, gitlab_project, days_of_week = task
+            task_id, days_of_week = task.id, task.days_of_week
+            gitlab_token, gitlab_events, gitlab_project = task.gitlab_token, task.gitlab_events, task.gitlab_project
             
             # 检查项目是否匹配
             if gitlab_project and project_path != gitlab_project:
@@ -67,17 +84,17 @@ def register_gitlab_routes(app):
                     continue
             
             # 解析GitLab事件
-            message, success = parse_gitlab_event(event_type, event_data)
+            if parsed is None:
+                parsed = parse_gitlab_event(event_type, event_data)
+            message, success = parsed
             
             if success:
-                # 发送飞书消息
-                send_success, send_message = send_feishu_message(feishu_webhook, message)
-                
-                # 记录日志
-                execute_query(
-                    "INSERT INTO logs (task_id, status, message) VALUES (?, ?, ?)",
-                    (task_id, "成功" if send_success else "失败", f"GitLab事件处理: {event_type}" if send_success else f"GitLab事件处理失败: {send_message}"),
-                    commit=True
+                # 发送飞书消息（开启合并窗口的任务会先缓存推送事件），发送完成后记录日志
+                event_coalescer.submit(
+                    task, 'gitlab', event_type, event_data, message,
+                    lambda event_count, task_id=task_id: _log_delivery(task_id, event_type, event_count)
                 )
+                queued += 1
         
+        logger.info(f"GitLab事件已放入发送队列: {queued} 条消息")
         return jsonify({'success': True, 'message': 'GitLab Webhook已处理'})
@@ -1,5 +1,6 @@
-from flask import jsonify
-from services.log_service import get_logs, clear_logs
+from flask import request, jsonify
+from services.log_service import get_logs, clear_logs, DEFAULT_LOG_PAGE_SIZE
+from services.log_retention import run_retention
 from utils.logger import logger
 
 def register_log_routes(app):
@@ -7,8 +8,19 @@ def register_log_routes(app):
     
     @app.route('/api/logs', methods=['GET'])
     def get_logs_route():
-        """获取日志列表"""
-        logs = get_logs()
+        """获取日志列表，支持游标分页和按任务、状态、时间范围过滤"""
+        try:
+            logs, next_cursor = get_logs(
+                limit=request.args.get('limit', DEFAULT_LOG_PAGE_SIZE, type=int),
+                cursor=request.args.get('cursor'),
+                task_id=request.args.get('task_id', type=int),
+                status=request.args.get('status'),
+                start_time=request.args.get('start_time'),
+                end_time=request.args.get('end_time')
+            )
+        except ValueError as e:
+            logger.warning(f"获取日志参数错误: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         log_list = []
         for log in logs:
@@ -22,16 +34,27 @@ def register_log_routes(app):
             })
         
         logger.debug(f"返回 {len(log_list)} 条日志")
-        return jsonify({'logs': log_list})
+        return jsonify({'logs': log_list, 'next_cursor': next_cursor, 'has_more': next_cursor is not None})
     
     @app.route('/api/clear_logs', methods=['POST'])
     def clear_logs_route():
         """清空日志"""
         try:
             logger.info("清空日志")
-            clear_logs()
-            logger.info("日志已清空")
+            deleted = clear_logs()
+            logger.info(f"日志已清空，共删除 {deleted} 条")
             return jsonify({'success': True, 'message': '日志已清空'})
         except Exception as e:
             logger.error(f"清空日志失败: {str(e)}")
             return jsonify({'success': False, 'message': f'清空日志失败: {str(e)}'})
+    
+    @app.route('/api/logs/retention', methods=['POST'])
+    def run_retention_route():
+        """立即按保留策略清理日志"""
+        try:
+            logger.info("手动执行日志清理")
+            result = run_retention()
+            return jsonify({'success': True, 'result': result})
+        except Exception as e:
+            logger.error(f"日志清理失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'日志清理失败: {str(e)}'})
@@ -0,0 +1,30 @@
+from flask import jsonify, request
+from scheduler.task_scheduler import get_scheduler_stats
+from services.run_metrics import get_run_metrics
+from utils.config import RUN_METRICS_WINDOW_HOURS
+from utils.logger import logger
+
+def register_scheduler_routes(app):
+    """注册调度器相关路由"""
+    
+    @app.route('/api/scheduler/stats', methods=['GET'])
+    def scheduler_stats():
+        """获取调度器线程池排队和等待时间统计"""
+        try:
+            return jsonify({'success': True, 'stats': get_scheduler_stats()})
+        except Exception as e:
+            logger.error(f"获取调度器统计失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'获取调度器统计失败: {str(e)}'})
+
+    @app.route('/api/scheduler/metrics', methods=['GET'])
+    def run_metrics():
+        """获取任务执行各阶段（调度延迟、生成、渲染、发送）耗时的p50/p95/p99，单位毫秒"""
+        try:
+            task_id = request.args.get('task_id', type=int)
+            hours = request.args.get('hours', RUN_METRICS_WINDOW_HOURS, type=int)
+            if hours <= 0:
+                return jsonify({'success': False, 'message': 'hours必须大于0'}), 400
+            return jsonify({'success': True, 'metrics': get_run_metrics(task_id, hours)})
+        except Exception as e:
+            logger.error(f"获取任务执行耗时统计失败: {str(e)}")
+            return jsonify({'success': False, 'message': f'获取任务执行耗时统计失败: {str(e)}'})
@@ -1,96 +1,44 @@
-from flask import request, jsonify
-from services.task_service import get_all_tasks, get_task_by_id, create_task, update_task, delete_task, execute_task
-from scheduler.task_scheduler import update_scheduler
+import json
+from flask import request, jsonify, Response
+from services.task_service import (get_all_tasks, get_task_by_id, get_enabled_tasks, create_task, update_task,
+                                   delete_task, execute_task, validate_tasks, validate_task_data, bulk_create_tasks)
+from scheduler.task_scheduler import update_scheduler, schedule_task, unschedule_task
 import threading
 from utils.logger import logger
 
+MAX_BULK_TASKS = 10000
+
+def _parse_bulk_body():
+    """解析批量导入的请求体，返回任务数据列表"""
+    body = request.get_data(as_text=True)
+    if 'ndjson' in (request.content_type or ''):
+        tasks_data = []
+        for line_no, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                tasks_data.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f"第 {line_no} 行不是有效的JSON")
+        return tasks_data
+    
+    try:
+        data = json.loads(body) if body.strip() else []
+    except ValueError:
+        raise ValueError("请求体不是有效的JSON")
+    if isinstance(data, dict):
+        data = data.get('tasks', [])
+    if not isinstance(data, list):
+        raise ValueError("请求体应为任务数组或 {\"tasks\": [...]}")
+    return data
+
 def register_task_routes(app):
     """注册任务相关路由"""
     
     @app.route('/api/tasks', methods=['GET'])
     def get_tasks():
         """获取所有任务"""
-        tasks = get_all_tasks()
-        
-        task_list = []
-        for task in tasks:
-            task_data = {
-                'id': task[0],
-                'name': task[1],
-                'type': task[2],
-                'webhook_url': task[3],
-                'cron_expression': task[4],
-                'enabled': bool(task[5]),
-                'created_at': task[6],
-                'updated_at': task[7],
-                'content': task[8],
-                'api_url': task[9],
-                'api_key': task[10]
-            }
-            # 如果有第11个元素（days_of_week），则添加到task_data中
-            if len(task) > 11:
-                task_data['days_of_week'] = task[11]
-            else:
-                task_data['days_of_week'] = ''
-            
-            # 如果有第12个元素（model_name），则添加到task_data中
-            if len(task) > 12:
-                task_data['model_name'] = task[12]
-            else:
-                task_data['model_name'] = ''
-            
-            # 如果有第13个元素（ai_news_url），则添加到task_data中
-            if len(task) > 13:
-                task_data['ai_news_url'] = task[13]
-            else:
-                task_data['ai_news_url'] = ''
-            
-            # 添加GitLab相关字段
-            if len(task) > 14:
-                task_data['gitlab_url'] = task[14]
-            else:
-                task_data['gitlab_url'] = ''
-            
-            if len(task) > 15:
-                task_data['gitlab_token'] = task[15]
-            else:
-                task_data['gitlab_token'] = ''
-            
-            if len(task) > 16:
-                task_data['gitlab_events'] = task[16]
-            else:
-                task_data['gitlab_events'] = ''
-            
-            if len(task) > 17:
-                task_data['gitlab_project'] = task[17]
-            else:
-                task_data['gitlab_project'] = ''
-            
-            # 如果有第18个元素（github_url），则添加到task_data中
-            if len(task) > 18:
-                task_data['github_url'] = task[18]
-            else:
-                task_data['github_url'] = ''
-            
-            # 如果有第19个元素（github_token），则添加到task_data中
-            if len(task) > 19:
-                task_data['github_token'] = task[19]
-            else:
-                task_data['github_token'] = ''
-            
-            # 如果有第20个元素（github_events），则添加到task_data中
-            if len(task) > 20:
-                task_data['github_events'] = task[20]
-            else:
-                task_data['github_events'] = ''
-            
-            # 如果有第21个元素（github_project），则添加到task_data中
-            if len(task) > 21:
-                task_data['github_project'] = task[21]
-            else:
-                task_data['github_project'] = ''
-            
-            task_list.append(task_data)
+        task_list = [task.to_dict() for task in get_all_tasks()]
         
         logger.debug(f"返回 {len(task_list)} 个任务")
         return jsonify({'tasks': task_list})
@@ -105,81 +53,7 @@ def register_task_routes(app):
             logger.warning(f"任务ID {task_id} 不存在")
             return jsonify({'success': False, 'message': '任务不存在'}), 404
         
-        task_data = {
-            'id': task[0],
-            'name': task[1],
-            'type': task[2],
-            'webhook_url': task[3],
-            'cron_expression': task[4],
-            'enabled': bool(task[5]),
-            'created_at': task[6],
-            'updated_at': task[7],
-            'content': task[8],
-            'api_url': task[9],
-            'api_key': task[10]
-        }
-        # 如果有第11个元素（days_of_week），则添加到task_data中
-        if len(task) > 11:
-            task_data['days_of_week'] = task[11]
-        else:
-            task_data['days_of_week'] = ''
-        
-        # 如果有第12个元素（model_name），则添加到task_data中
-        if len(task) > 12:
-            task_data['model_name'] = task[12]
-        else:
-            task_data['model_name'] = ''
-        
-        # 如果有第13个元素（ai_news_url），则添加到task_data中
-        if len(task) > 13:
-            task_data['ai_news_url'] = task[13]
-        else:
-            task_data['ai_news_url'] = ''
-        
-        # 添加GitLab相关字段
-        if len(task) > 14:
-            task_data['gitlab_url'] = task[14]
-        else:
-            task_data['gitlab_url'] = ''
-        
-        if len(task) > 15:
-            task_data['gitlab_token'] = task[15]
-        else:
-            task_data['gitlab_token'] = ''
-        
-        if len(task) > 16:
-            task_data['gitlab_events'] = task[16]
-        else:
-            task_data['gitlab_events'] = ''
-        
-        if len(task) > 17:
-            task_data['gitlab_project'] = task[17]
-        else:
-            task_data['gitlab_project'] = ''
-        
-        # 如果有第18个元素（github_url），则添加到task_data中
-        if len(task) > 18:
-            task_data['github_url'] = task[18]
-        else:
-            task_data['github_url'] = ''
-        
-        # 如果有第19个元素（github_token），则添加到task_data中
-        if len(task) > 19:
-            task_data['github_token'] = task[19]
-        else:
-            task_data['github_token'] = ''
-        
-        # 如果有第20个元素（github_events），则添加到task_data中
-        if len(task) > 20:
-            task_data['github_events'] = task[20]
-        else:
-            task_data['github_events'] = ''
-        
-        # 如果有第21个元素（github_project），则添加到task_data中
-        if len(task) > 21:
-            task_data['github_project'] = task[21]
-        else:
-            task_data['github_project'] = ''
+        task_data = task.to_dict()
         
         logger.debug(f"返回任务详情: {task_data['name']}")
         return jsonify({'success': True, 'task': task_data})
@@ -187,27 +61,93 @@ def register_task_routes(app):
     @app.route('/api/tasks', methods=['POST'])
     def add_task():
         """添加任务"""
-        data = request.json
+        data = request.get_json(silent=True)
+        errors = validate_task_data(data)
+        if errors:
+            logger.warning(f"添加任务校验失败: {errors}")
+            return jsonify({'success': False, 'message': '任务数据校验失败', 'errors': errors}), 400
         logger.info(f"添加新任务: {data.get('name')}")
         
         task_id = create_task(data)
         
-        # 更新调度器
-        update_scheduler()
+        # 只同步新建的任务
+        schedule_task(task_id)
         
         logger.info(f"任务添加成功，ID: {task_id}")
         return jsonify({'success': True, 'task_id': task_id})
     
+    @app.route('/api/tasks/bulk', methods=['POST'])
+    def bulk_import_tasks():
+        """批量导入任务，支持JSON数组或NDJSON（每行一个任务）"""
+        try:
+            tasks_data = _parse_bulk_body()
+        except ValueError as e:
+            logger.warning(f"批量导入任务解析失败: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if not tasks_data:
+            return jsonify({'success': False, 'message': '没有需要导入的任务'}), 400
+        if len(tasks_data) > MAX_BULK_TASKS:
+            return jsonify({'success': False, 'message': f'单次最多导入 {MAX_BULK_TASKS} 个任务'}), 400
+        
+        # 全部校验通过后才写入
+        errors = validate_tasks(tasks_data)
+        if errors:
+            logger.warning(f"批量导入任务校验失败: {len(errors)} 个任务有误")
+            return jsonify({'success': False, 'message': '任务数据校验失败', 'errors': errors}), 400
+        
+        try:
+            task_ids = bulk_create_tasks(tasks_data)
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'批量导入任务失败: {str(e)}'}), 500
+        
+        # 全部写入后只对账一次调度器
+        update_scheduler()
+        
+        logger.info(f"批量导入 {len(task_ids)} 个任务成功")
+        return jsonify({'success': True, 'task_ids': task_ids})
+    
+    @app.route('/api/tasks/export', methods=['GET'])
+    def export_tasks():
+        """流式导出任务，默认NDJSON，format=json时导出JSON数组"""
+        tasks = get_all_tasks()
+        export_format = request.args.get('format', 'ndjson')
+        
+        if export_format == 'json':
+            def generate():
+                yield '['
+                for index, task in enumerate(tasks):
+                    yield (',' if index else '') + json.dumps(task.to_dict(), ensure_ascii=False)
+                yield ']'
+            mimetype = 'application/json'
+            filename = 'tasks.json'
+        else:
+            def generate():
+                for task in tasks:
+                    yield json.dumps(task.to_dict(), ensure_ascii=False) + '\n'
+            mimetype = 'application/x-ndjson'
+            filename = 'tasks.ndjson'
+        
+        logger.info(f"导出 {len(tasks)} 个任务")
+        return Response(generate(), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    
     @app.route('/api/tasks/<int:task_id>', methods=['PUT'])
     def update_task_route(task_id):
         """更新任务"""
-        data = request.json
+        data = request.get_json(silent=True)
+        # 只切换启用状态时不需要完整的任务数据
+        if not (isinstance(data, dict) and set(data) == {'enabled'}):
+            errors = validate_task_data(data)
+            if errors:
+                logger.warning(f"更新任务ID {task_id} 校验失败: {errors}")
+                return jsonify({'success': False, 'message': '任务数据校验失败', 'errors': errors}), 400
         logger.info(f"更新任务ID {task_id}")
         
         update_task(task_id, data)
         
-        # 更新调度器
-        update_scheduler()
+        # 只同步被修改的任务
+        schedule_task(task_id)
         
         logger.info(f"任务ID {task_id} 更新成功")
         return jsonify({'success': True})
@@ -219,8 +159,8 @@ def register_task_routes(app):
         
         delete_task(task_id)
         
-        # 更新调度器
-        update_scheduler()
+        # 只移除被删除的任务
+        unschedule_task(task_id)
         
         logger.info(f"任务ID {task_id} 删除成功")
         return jsonify({'success': True})
@@ -239,14 +179,14 @@ def register_task_routes(app):
         """获取任务统计信息"""
         logger.info("获取任务统计信息")
         try:
-            from models.db import execute_query
             from datetime import datetime, timedelta
             
             # 获取总任务数
-            total_tasks = execute_query("SELECT COUNT(*) FROM tasks", fetch_one=True)[0]
+            total_tasks = len(get_all_tasks())
             
             # 获取活跃任务数
-            active_tasks = execute_query("SELECT COUNT(*) FROM tasks WHERE enabled = 1", fetch_one=True)[0]
+            enabled_tasks = get_enabled_tasks()
+            active_tasks = len(enabled_tasks)
             
             # 获取下一次执行时间
             next_run = "暂无"
@@ -256,11 +196,8 @@ def register_task_routes(app):
                 now = datetime.now()
                 next_run_times = []
                 
-                # 获取所有活跃任务
-                tasks = execute_query("SELECT id, cron_expression, days_of_week FROM tasks WHERE enabled = 1")
-                
-                for task in tasks:
-                    task_id, cron_expression, days_of_week = task
+                for task in enabled_tasks:
+                    cron_expression, days_of_week = task.cron_expression, task.days_of_week
                     
                     # 解析cron表达式
                     parts = cron_expression.split(':')
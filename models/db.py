@@ -1,107 +1,166 @@
 import sqlite3
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from models.migrations import run_migrations
 from utils.logger import logger
+from utils.config import DATABASE_NAME, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS
 
-DATABASE_NAME = 'feishu_bot.db'
+_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+class ConnectionPool:
+    """SQLite连接池
+
+    复用长连接，避免每次查询都重新建立连接；所有连接统一开启WAL模式、
+    设置busy_timeout和synchronous级别，减少并发写入时的"database is locked"错误。
+    """
+
+    def __init__(self, database, size=DB_POOL_SIZE, busy_timeout=DB_BUSY_TIMEOUT, synchronous=DB_SYNCHRONOUS):
+        self.database = database
+        self.size = max(1, size)
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous if synchronous in _SYNCHRONOUS_LEVELS else 'NORMAL'
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self):
+        """创建并配置一个新连接"""
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        # 设置数据库时区为东八区
+        conn.execute("PRAGMA timezone='+08:00'")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        logger.debug(f"创建新的数据库连接: {self.database}")
+        return conn
+
+    def acquire(self, timeout=DB_POOL_TIMEOUT):
+        """从连接池获取连接，池满时最多等待timeout秒"""
+        if self._closed:
+            raise RuntimeError("数据库连接池已关闭")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"获取数据库连接超时（{timeout}秒）")
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"归还连接时回滚失败，丢弃该连接: {str(e)}")
+            self._discard(conn)
+            return
+        if self._closed:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器的方式借用连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """连接池状态"""
+        with self._lock:
+            created = self._created
+        return {'size': self.size, 'created': created, 'idle': self._idle.qsize()}
+
+    def close_all(self):
+        """关闭所有空闲连接，之后归还的连接也会被直接关闭"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        logger.info("数据库连接池已关闭")
+
+_pool = ConnectionPool(DATABASE_NAME)
+atexit.register(_pool.close_all)
+
+def get_pool():
+    """获取全局连接池"""
+    return _pool
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    # 设置数据库时区为东八区
-    conn.execute("PRAGMA timezone='+08:00'")
-    return conn
+    """获取数据库连接（上下文管理器，使用完毕自动归还连接池）"""
+    return _pool.connection()
+
+@contextmanager
+def transaction():
+    """在单个事务中执行多条语句，正常退出时提交，异常时回滚"""
+    with _pool.connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 def init_db():
-    """初始化数据库"""
+    """初始化数据库（执行尚未应用的迁移）"""
     logger.info("***正在初始化AC-bot数据库...")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # 创建任务表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        type TEXT NOT NULL,
-        webhook_url TEXT NOT NULL,
-        cron_expression TEXT NOT NULL,
-        enabled INTEGER DEFAULT 1,
-        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
-        updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
-        content TEXT,
-        api_url TEXT,
-        api_key TEXT,
-        days_of_week TEXT,
-        model_name TEXT,
-        ai_news_url TEXT,
-        gitlab_url TEXT,
-        gitlab_token TEXT,
-        gitlab_events TEXT,
-        gitlab_project TEXT,
-        github_url TEXT,
-        github_token TEXT,
-        github_events TEXT,
-        github_project TEXT
-    )
-    ''')
-    
-    # 为现有表添加GitHub相关字段（如果不存在）
-    try:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN github_url TEXT")
-        logger.info("添加github_url字段成功")
-    except Exception as e:
-        logger.debug(f"github_url字段已存在或添加失败: {str(e)}")
-    
-    try:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN github_token TEXT")
-        logger.info("添加github_token字段成功")
-    except Exception as e:
-        logger.debug(f"github_token字段已存在或添加失败: {str(e)}")
-    
-    try:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN github_events TEXT")
-        logger.info("添加github_events字段成功")
-    except Exception as e:
-        logger.debug(f"github_events字段已存在或添加失败: {str(e)}")
-    
-    try:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN github_project TEXT")
-        logger.info("添加github_project字段成功")
-    except Exception as e:
-        logger.debug(f"github_project字段已存在或添加失败: {str(e)}")
-    
-    # 创建日志表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS logs (
-        id INTEGER PRIMARY KEY,
-        task_id INTEGER,
-        status TEXT,
-        message TEXT,
-        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
-        FOREIGN KEY (task_id) REFERENCES tasks (id)
-    )
-    ''')
-    conn.commit()
-    conn.close()
+    with _pool.connection() as conn:
+        run_migrations(conn)
     logger.info("***数据库初始化完成!")
 
 def execute_query(query, params=(), fetch_one=False, commit=False):
     """执行SQL查询"""
     logger.debug(f"执行SQL查询: {query[:50]}...  参数: {params}")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    
-    result = None
-    if fetch_one:
-        result = cursor.fetchone()
-        logger.debug(f"查询结果(单行): {result}")
-    else:
-        result = cursor.fetchall()
-        logger.debug(f"查询结果(多行): {len(result)} 行")
-    
-    if commit:
-        conn.commit()
-        logger.debug("事务已提交")
-    
-    conn.close()
+    with _pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+
+        result = None
+        if fetch_one:
+            result = cursor.fetchone()
+            logger.debug(f"查询结果(单行): {result}")
+        else:
+            result = cursor.fetchall()
+            logger.debug(f"查询结果(多行): {len(result)} 行")
+
+        if commit:
+            conn.commit()
+            logger.debug("事务已提交")
+
     return result
@@ -0,0 +1,247 @@
+from utils.logger import logger
+
+# 数据库迁移
+# 每个迁移步骤只执行一次，执行后记录到schema_version表；新增表结构变更时在MIGRATIONS末尾追加步骤
+
+def _create_base_tables(cursor):
+    """创建任务表和日志表"""
+    # 创建任务表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        webhook_url TEXT NOT NULL,
+        cron_expression TEXT NOT NULL,
+        enabled INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        content TEXT,
+        api_url TEXT,
+        api_key TEXT,
+        days_of_week TEXT,
+        model_name TEXT,
+        ai_news_url TEXT,
+        gitlab_url TEXT,
+        gitlab_token TEXT,
+        gitlab_events TEXT,
+        gitlab_project TEXT,
+        github_url TEXT,
+        github_token TEXT,
+        github_events TEXT,
+        github_project TEXT
+    )
+    ''')
+    # 创建日志表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY,
+        task_id INTEGER,
+        status TEXT,
+        message TEXT,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+
+def _add_missing_task_columns(cursor):
+    """为旧版本数据库补齐tasks表的字段"""
+    cursor.execute("PRAGMA table_info(tasks)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column in ('days_of_week', 'model_name', 'ai_news_url',
+                   'gitlab_url', 'gitlab_token', 'gitlab_events', 'gitlab_project',
+                   'github_url', 'github_token', 'github_events', 'github_project'):
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE tasks ADD COLUMN {column} TEXT")
+            logger.info(f"添加{column}字段成功")
+
+def _create_indexes(cursor):
+    """为日志查询和任务筛选创建索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_task_created_at ON logs (task_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_type_enabled ON tasks (type, enabled)")
+
+def _add_task_jitter(cursor):
+    """tasks表新增触发时间分散窗口字段"""
+    cursor.execute("PRAGMA table_info(tasks)")
+    if 'jitter_seconds' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN jitter_seconds INTEGER DEFAULT 0")
+
+def _create_cluster_tables(cursor):
+    """创建集群节点心跳表和变更版本表
+
+    tasks表的增删改由触发器递增sync_state中的版本号，其他节点据此发现任务变更。
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cluster_nodes (
+        node_id TEXT PRIMARY KEY,
+        started_at REAL NOT NULL,
+        heartbeat_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO sync_state (name, version) VALUES ('tasks', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_{event.lower()}_version AFTER {event} ON tasks
+        BEGIN
+            UPDATE sync_state SET version = version + 1 WHERE name = 'tasks';
+        END
+        ''')
+
+def _create_task_runs(cursor):
+    """创建任务执行耗时表，时间为Unix时间戳，耗时单位为毫秒"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS task_runs (
+        id INTEGER PRIMARY KEY,
+        task_id INTEGER NOT NULL,
+        status TEXT,
+        scheduled_at REAL,
+        started_at REAL NOT NULL,
+        lag_ms INTEGER,
+        generate_ms INTEGER,
+        render_ms INTEGER,
+        send_ms INTEGER,
+        total_ms INTEGER
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_runs_started_at ON task_runs (started_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_runs_task_started_at ON task_runs (task_id, started_at)")
+
+def _create_outbox(cursor):
+    """创建待发送消息表（outbox），id由写入方生成，时间为Unix时间戳"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id TEXT PRIMARY KEY,
+        task_id INTEGER,
+        webhook_url TEXT NOT NULL,
+        body BLOB NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL,
+        last_error TEXT,
+        owner TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt ON outbox (status, next_attempt_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_updated_at ON outbox (status, updated_at)")
+
+def _add_task_coalesce(cursor):
+    """tasks表新增Git事件合并窗口字段"""
+    cursor.execute("PRAGMA table_info(tasks)")
+    if 'coalesce_seconds' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN coalesce_seconds INTEGER DEFAULT 0")
+
+def _add_task_llm_limits(cursor):
+    """tasks表新增大模型生成截止时间和最大输出token数字段"""
+    cursor.execute("PRAGMA table_info(tasks)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'llm_deadline_seconds' not in columns:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN llm_deadline_seconds INTEGER DEFAULT 0")
+    if 'llm_max_tokens' not in columns:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN llm_max_tokens INTEGER DEFAULT 0")
+
+def _add_task_llm_fallbacks(cursor):
+    """tasks表新增大模型备用服务商/模型列表字段"""
+    cursor.execute("PRAGMA table_info(tasks)")
+    if 'llm_fallbacks' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN llm_fallbacks TEXT")
+
+def _enable_incremental_vacuum(cursor):
+    """启用增量auto_vacuum，日志清理后只需增量回收空闲页
+
+    已有数据库需整库VACUUM一次才会生效，耗时与库大小成正比，不在启动时执行，由日志清理任务完成。
+    """
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+def _create_apscheduler_jobs(cursor):
+    """创建持久化调度任务表（ACBOT_SCHEDULER_JOBSTORE=sqlite时使用）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS apscheduler_jobs (
+        id TEXT PRIMARY KEY,
+        next_run_time REAL,
+        job_state BLOB NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_apscheduler_jobs_next_run_time ON apscheduler_jobs (next_run_time)")
+
+def _add_cluster_applied_nodes(cursor):
+    """cluster_nodes表新增已生效节点列表字段，节点加入时据此确认原节点已移交任务"""
+    cursor.execute("PRAGMA table_info(cluster_nodes)")
+    if 'applied_nodes' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE cluster_nodes ADD COLUMN applied_nodes TEXT")
+
+# (版本号, 说明, 迁移函数)，版本号必须递增
+MIGRATIONS = [
+    (1, '创建任务表和日志表', _create_base_tables),
+    (2, '补齐tasks表的GitLab/GitHub字段', _add_missing_task_columns),
+    (3, '创建logs和tasks索引', _create_indexes),
+    (4, 'tasks表新增jitter_seconds字段', _add_task_jitter),
+    (5, '创建集群节点心跳表和任务变更版本', _create_cluster_tables),
+    (6, '创建任务执行耗时表', _create_task_runs),
+    (7, '创建待发送消息表', _create_outbox),
+    (8, 'tasks表新增coalesce_seconds字段', _add_task_coalesce),
+    (9, 'tasks表新增llm_deadline_seconds和llm_max_tokens字段', _add_task_llm_limits),
+    (10, 'tasks表新增llm_fallbacks字段', _add_task_llm_fallbacks),
+    (11, '启用增量auto_vacuum', _enable_incremental_vacuum),
+    (12, '创建持久化调度任务表', _create_apscheduler_jobs),
+    (13, 'cluster_nodes表新增applied_nodes字段', _add_cluster_applied_nodes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _ensure_version_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    )
+    ''')
+
+def get_schema_version(conn):
+    """获取当前数据库结构版本，未初始化时返回0"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+    if not cursor.fetchone():
+        return 0
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+def run_migrations(conn):
+    """按顺序执行尚未应用的迁移步骤，已是最新版本时直接返回"""
+    current = get_schema_version(conn)
+    if current >= LATEST_VERSION:
+        logger.info(f"数据库结构已是最新版本: v{current}")
+        return current
+
+    # 加写锁后重新读取版本，避免多个进程同时迁移
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        _ensure_version_table(cursor)
+        current = get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"执行数据库迁移 v{version}: {description}")
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            current = version
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"数据库迁移完成，当前版本: v{current}")
+    return current
@@ -0,0 +1,100 @@
+import json
+from models.db import get_db_connection
+
+# tasks表的全部字段，顺序与建表语句一致
+TASK_FIELDS = (
+    'id', 'name', 'type', 'webhook_url', 'cron_expression', 'enabled',
+    'created_at', 'updated_at', 'content', 'api_url', 'api_key', 'days_of_week',
+    'model_name', 'ai_news_url',
+    'gitlab_url', 'gitlab_token', 'gitlab_events', 'gitlab_project',
+    'github_url', 'github_token', 'github_events', 'github_project',
+    'jitter_seconds', 'coalesce_seconds', 'llm_deadline_seconds', 'llm_max_tokens', 'llm_fallbacks',
+)
+
+# 创建/更新任务时由调用方提供的字段
+TASK_WRITABLE_FIELDS = tuple(f for f in TASK_FIELDS if f not in ('id', 'created_at', 'updated_at'))
+
+# 完整更新任务时，请求中未提供则保留原值的字段（只能通过接口设置，管理页面不会提交）
+TASK_PRESERVED_FIELDS = ('jitter_seconds', 'coalesce_seconds', 'llm_deadline_seconds', 'llm_max_tokens', 'llm_fallbacks')
+
+# 以JSON文本保存的字段，接口中为列表
+TASK_JSON_FIELDS = ('llm_fallbacks',)
+
+# 未提供时使用的默认值（其余字段默认为NULL）
+_FIELD_DEFAULTS = {
+    'days_of_week': '',
+    'gitlab_events': '',
+    'github_events': '',
+    'jitter_seconds': 0,
+    'coalesce_seconds': 0,
+    'llm_deadline_seconds': 0,
+    'llm_max_tokens': 0,
+}
+
+class Task:
+    """任务记录
+
+    按列名而不是列位置从数据库行构建，表结构新增字段不会导致错位；
+    缓存中的Task实例会被多个线程共享，只读使用，不要修改。
+    """
+
+    __slots__ = TASK_FIELDS
+
+    def __init__(self, **fields):
+        for field in TASK_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_row(cls, row, columns):
+        """根据查询结果行和列名构建任务"""
+        task = cls.__new__(cls)
+        values = dict(zip(columns, row))
+        for field in TASK_FIELDS:
+            setattr(task, field, values.get(field))
+        return task
+
+    def to_dict(self):
+        """序列化为接口返回的JSON结构"""
+        data = {field: getattr(self, field) for field in TASK_FIELDS}
+        data['enabled'] = bool(self.enabled)
+        for field in TASK_JSON_FIELDS:
+            data[field] = decode_json_field(data[field])
+        return data
+
+    def __repr__(self):
+        return f"Task(id={self.id!r}, name={self.name!r}, type={self.type!r})"
+
+def task_values(task_data, fields=TASK_WRITABLE_FIELDS):
+    """将请求数据转换为与fields顺序一致的参数元组"""
+    values = []
+    for field in fields:
+        if field == 'enabled':
+            values.append(1 if task_data.get('enabled', True) else 0)
+        elif field in TASK_JSON_FIELDS and isinstance(task_data.get(field), (list, dict)):
+            values.append(json.dumps(task_data[field], ensure_ascii=False))
+        else:
+            values.append(task_data.get(field, _FIELD_DEFAULTS.get(field)))
+    return tuple(values)
+
+def int_field(value, default=0):
+    """读取整数字段，数据库中的值不是整数时返回default"""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return default
+
+def decode_json_field(value):
+    """解析以JSON文本保存的字段，为空或格式错误时返回None"""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return None
+
+def load_tasks(where='', params=()):
+    """查询任务并构建为Task列表"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(f"SELECT * FROM tasks {where}", params)
+        columns = [column[0] for column in cursor.description]
+        return [Task.from_row(row, columns) for row in cursor.fetchall()]
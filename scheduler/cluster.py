@@ -0,0 +1,166 @@
+import time
+import zlib
+import threading
+from models.db import transaction
+from utils.logger import logger
+from utils.config import CLUSTER_NODE_ID, CLUSTER_HEARTBEAT_SECONDS, CLUSTER_LEASE_SECONDS
+
+class ClusterCoordinator:
+    """集群节点协调器
+
+    每个节点定期在cluster_nodes表中写入心跳，并清理超过lease_seconds未心跳的节点。
+    任务按ID在存活节点之间做rendezvous哈希分配：节点增减时只有该节点对应的任务会迁移，
+    所有节点根据同一份节点列表计算，结果一致。节点列表或任务版本变化时回调on_change。
+    每个节点在心跳中公布其调度任务所依据的节点列表（applied_nodes），按该列表仍由其他节点负责的任务
+    本节点暂不认领，待原节点移除调度任务并公布新列表后再接管，避免节点加入时同一任务被两个节点同时调度。
+    未启动时视为单机运行，拥有全部任务。
+    """
+
+    def __init__(self, node_id=CLUSTER_NODE_ID, heartbeat_seconds=CLUSTER_HEARTBEAT_SECONDS,
+                 lease_seconds=CLUSTER_LEASE_SECONDS):
+        self.node_id = node_id
+        self.heartbeat_seconds = max(0.1, heartbeat_seconds)
+        self.lease_seconds = max(self.heartbeat_seconds * 2, lease_seconds)
+        self._on_change = None
+        self._nodes = ()
+        # 其他节点公布的已生效节点列表，以及本节点已生效的节点列表
+        self._peer_views = {}
+        self._applied = ()
+        self._tasks_version = None
+        self._last_heartbeat = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.heartbeat_failures = 0
+        self.rebalances = 0
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self, on_change=None):
+        """注册本节点并启动心跳线程，首次心跳同步完成，返回后即可判断任务归属"""
+        if self._thread is not None:
+            return
+        self._on_change = on_change
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._run, name='cluster-heartbeat', daemon=True)
+        self._thread.start()
+        logger.info(f"*** 集群节点已启动: {self.node_id}，当前存活节点 {len(self._nodes)} 个")
+
+    def stop(self):
+        """停止心跳并注销本节点，其他节点会在下一次心跳时接管本节点的任务"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(self.heartbeat_seconds * 2)
+        try:
+            with transaction() as conn:
+                conn.execute("DELETE FROM cluster_nodes WHERE node_id = ?", (self.node_id,))
+        except Exception as e:
+            logger.error(f"注销集群节点失败: {str(e)}")
+        logger.info(f"集群节点已注销: {self.node_id}")
+
+    def nodes(self):
+        """当前存活节点列表，按节点ID排序"""
+        return list(self._nodes)
+
+    def _is_live(self):
+        # 本节点心跳长时间写入失败时，其他节点已将其视为下线，此时不再认领任何任务
+        return time.monotonic() - self._last_heartbeat < self.lease_seconds
+
+    def owner(self, task_id, nodes=None):
+        """任务归属的节点ID，nodes未提供时按当前存活节点计算"""
+        nodes = self._nodes if nodes is None else nodes
+        if not nodes:
+            return self.node_id
+        return max(nodes, key=lambda node_id: zlib.crc32(f"{node_id}:{task_id}".encode('utf-8')))
+
+    def owns(self, task_id):
+        """本节点是否负责调度该任务：任务归属本节点，且没有其他节点仍按其已生效的节点列表调度该任务"""
+        if not self.enabled:
+            return True
+        if not self._is_live() or self.owner(task_id) != self.node_id:
+            return False
+        return all(self.owner(task_id, view) != node_id
+                   for node_id, view in self._peer_views.items() if view)
+
+    def mark_applied(self, nodes):
+        """调度器按nodes完成对账后调用，立即公布，其他节点据此接管本节点已移除的任务"""
+        nodes = tuple(nodes)
+        if not self.enabled or nodes == self._applied:
+            return
+        self._applied = nodes
+        try:
+            with transaction() as conn:
+                conn.execute("UPDATE cluster_nodes SET applied_nodes = ? WHERE node_id = ?",
+                             (','.join(nodes), self.node_id))
+        except Exception as e:
+            # 下一次心跳会再次写入
+            logger.warning(f"公布集群节点列表失败: {str(e)}")
+
+    def is_leader(self):
+        """本节点是否为主节点（节点ID最小的存活节点），负责日志清理等全局维护任务"""
+        if not self.enabled:
+            return True
+        return self._is_live() and bool(self._nodes) and self._nodes[0] == self.node_id
+
+    def _heartbeat(self):
+        now = time.time()
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO cluster_nodes (node_id, started_at, heartbeat_at, applied_nodes) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(node_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, "
+                "applied_nodes = excluded.applied_nodes",
+                (self.node_id, now, now, ','.join(self._applied))
+            )
+            conn.execute("DELETE FROM cluster_nodes WHERE heartbeat_at < ?", (now - self.lease_seconds,))
+            rows = conn.execute("SELECT node_id, applied_nodes FROM cluster_nodes ORDER BY node_id").fetchall()
+            row = conn.execute("SELECT version FROM sync_state WHERE name = 'tasks'").fetchone()
+        self._last_heartbeat = time.monotonic()
+
+        nodes = tuple(node_id for node_id, _ in rows)
+        peer_views = {node_id: tuple(filter(None, (applied or '').split(',')))
+                      for node_id, applied in rows if node_id != self.node_id}
+        tasks_version = row[0] if row else 0
+        tasks_changed = self._tasks_version is not None and tasks_version != self._tasks_version
+        if nodes != self._nodes and self._tasks_version is not None:
+            self.rebalances += 1
+            logger.info(f"*** 集群节点变化: {list(self._nodes)} -> {list(nodes)}")
+        # 其他节点公布了新的节点列表时也要重新对账，接管其已移交的任务
+        nodes_changed = nodes != self._nodes or peer_views != self._peer_views
+        self._nodes = nodes
+        self._peer_views = peer_views
+        self._tasks_version = tasks_version
+        return nodes_changed, tasks_changed
+
+    def _run(self):
+        while not self._stop_event.wait(self.heartbeat_seconds):
+            try:
+                nodes_changed, tasks_changed = self._heartbeat()
+            except Exception as e:
+                self.heartbeat_failures += 1
+                logger.error(f"集群心跳失败: {str(e)}")
+                if self._is_live() or not self._nodes:
+                    continue
+                # 租约已过期，清空节点列表并通知调度器移除本节点的全部任务
+                logger.warning(f"集群节点 {self.node_id} 租约已过期，停止调度任务")
+                self._nodes = ()
+                nodes_changed, tasks_changed = True, False
+            if (nodes_changed or tasks_changed) and self._on_change:
+                try:
+                    self._on_change(nodes_changed, tasks_changed)
+                except Exception as e:
+                    logger.error(f"集群变化处理失败: {str(e)}")
+
+    def stats(self):
+        """集群状态"""
+        return {
+            'enabled': self.enabled,
+            'node_id': self.node_id,
+            'nodes': self.nodes(),
+            'leader': self.is_leader(),
+            'rebalances': self.rebalances,
+            'heartbeat_failures': self.heartbeat_failures,
+        }
+
+cluster = ClusterCoordinator()
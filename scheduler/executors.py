@@ -0,0 +1,82 @@
+import time
+import threading
+from collections import deque
+from apscheduler.executors.base import run_job
+from apscheduler.executors.pool import ThreadPoolExecutor
+from utils.stats import percentile
+from services.run_metrics import set_scheduled_time
+
+class MonitoredThreadPoolExecutor(ThreadPoolExecutor):
+    """带排队统计的线程池执行器
+
+    在APScheduler线程池执行器的基础上记录排队数、运行数以及任务从提交到开始执行的等待时间，
+    用于判断某个线程池是否被慢任务占满。执行期间当前线程可通过get_scheduled_time取得本次触发的计划时间。
+    """
+
+    def __init__(self, max_workers=10, name='default'):
+        super().__init__(max_workers)
+        self.name = name
+        self.max_workers = int(max_workers)
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=500)
+
+    def _do_submit_job(self, job, run_times):
+        submitted_at = time.monotonic()
+        with self._stats_lock:
+            self._queued += 1
+            self._submitted += 1
+
+        def tracked_run_job(*args):
+            wait = time.monotonic() - submitted_at
+            with self._stats_lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._recent_waits.append(wait)
+            # 供任务记录本次触发的计划时间，用于计算调度延迟
+            set_scheduled_time(run_times[-1].timestamp())
+            try:
+                return run_job(*args)
+            finally:
+                set_scheduled_time(None)
+                with self._stats_lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        def callback(f):
+            exc, tb = (
+                f.exception_info()
+                if hasattr(f, "exception_info")
+                else (f.exception(), getattr(f.exception(), "__traceback__", None))
+            )
+            if exc:
+                self._run_job_error(job.id, exc, tb)
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit(tracked_run_job, job, job._jobstore_alias, run_times, self._logger.name)
+        f.add_done_callback(callback)
+
+    def stats(self):
+        """线程池状态，等待时间单位为秒"""
+        with self._stats_lock:
+            waits = sorted(self._recent_waits)
+            started = self._completed + self._running
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'queued': self._queued,
+                'running': self._running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'wait_avg': round(self._wait_total / started, 3) if started else 0.0,
+                'wait_max': round(self._wait_max, 3),
+                'wait_p95': round(percentile(waits, 95), 3),
+            }
@@ -0,0 +1,109 @@
+import pickle
+import sqlite3
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+from models.db import execute_query, transaction, init_db
+from utils.logger import logger
+
+class SQLiteJobStore(BaseJobStore):
+    """基于项目数据库连接池的APScheduler持久化任务存储
+
+    任务以pickle形式保存在同一个SQLite文件中，重启后直接加载已有任务，
+    不需要重新计算触发时间，重启期间错过的触发也能在启动后补偿执行。
+    与APScheduler自带的SQLAlchemyJobStore行为一致，但不依赖SQLAlchemy。
+    """
+
+    # 表结构由数据库迁移创建
+    tablename = 'apscheduler_jobs'
+
+    def __init__(self, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.pickle_protocol = pickle_protocol
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        # 调度器在导入时启动，早于应用调用init_db，先执行尚未应用的迁移以确保任务表已创建
+        init_db()
+        logger.info(f"*** 持久化任务存储已启动: {self.tablename}")
+
+    def lookup_job(self, job_id):
+        row = execute_query(f"SELECT job_state FROM {self.tablename} WHERE id = ?", (job_id,), fetch_one=True)
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("WHERE next_run_time <= ?", (timestamp,))
+
+    def get_next_run_time(self):
+        row = execute_query(
+            f"SELECT next_run_time FROM {self.tablename} WHERE next_run_time IS NOT NULL "
+            "ORDER BY next_run_time LIMIT 1",
+            fetch_one=True
+        )
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            with transaction() as conn:
+                conn.execute(
+                    f"INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)",
+                    (job.id, datetime_to_utc_timestamp(job.next_run_time), self._dump(job))
+                )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        with transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?",
+                (datetime_to_utc_timestamp(job.next_run_time), self._dump(job), job.id)
+            )
+            if cursor.rowcount == 0:
+                raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with transaction() as conn:
+            cursor = conn.execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+            if cursor.rowcount == 0:
+                raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        execute_query(f"DELETE FROM {self.tablename}", commit=True)
+
+    def _dump(self, job):
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where='', params=()):
+        jobs = []
+        failed_job_ids = []
+        rows = execute_query(f"SELECT id, job_state FROM {self.tablename} {where} ORDER BY next_run_time", params)
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                logger.exception(f"无法恢复调度任务 {job_id}，已将其移除")
+                failed_job_ids.append(job_id)
+
+        # 移除无法恢复的任务
+        if failed_job_ids:
+            with transaction() as conn:
+                conn.executemany(f"DELETE FROM {self.tablename} WHERE id = ?", [(job_id,) for job_id in failed_job_ids])
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (tablename={self.tablename})>"
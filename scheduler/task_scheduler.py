@@ -1,74 +1,401 @@
+import zlib
+import atexit
+import threading
+from collections import Counter
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
 from apscheduler.triggers.cron import CronTrigger
-from models.db import execute_query
-from services.task_service import execute_task
+from apscheduler.jobstores.memory import MemoryJobStore
+from scheduler.job_store import SQLiteJobStore
+from scheduler.cluster import cluster
+from models.task import int_field
+from services.task_service import execute_task, pregenerate_content, get_task_by_id, get_enabled_tasks
+from services.content_cache import content_cache
+from services.ai_service import llm_clients
+from services.completion_cache import completion_cache
+from services.llm_metrics import llm_metrics
+from services.llm_limiter import llm_limiter
+from services.task_registry import task_registry
+from services.delivery_queue import delivery_queue
+from services.log_retention import run_retention, vacuum
+from scheduler.executors import MonitoredThreadPoolExecutor
+from utils.config import (LOG_RETENTION_INTERVAL_MINUTES, LOG_VACUUM_INTERVAL_HOURS, SCHEDULER_JOBSTORE,
+                          SCHEDULER_MISFIRE_GRACE, SCHEDULER_MISFIRE_GRACE_DEFAULT, SCHEDULER_POOL_SIZE,
+                          SCHEDULER_TYPE_POOL_SIZES, SCHEDULER_COALESCE, SCHEDULER_MAX_INSTANCES,
+                          SCHEDULER_MAX_INSTANCES_DEFAULT, SCHEDULER_MAX_FIRES_PER_SECOND,
+                          PREGENERATE_LEAD_MINUTES, PREGENERATE_TYPES, CLUSTER_ENABLED,
+                          OUTBOX_RECOVERY_INTERVAL_SECONDS)
 from utils.logger import logger
 
+def _create_jobstores():
+    """持久化模式下任务保存在数据库中，维护任务始终只保存在内存中"""
+    jobstores = {'default': MemoryJobStore()}
+    if SCHEDULER_JOBSTORE == 'sqlite' and CLUSTER_ENABLED:
+        # 持久化任务表由所有节点共享，会导致每个节点都加载全部任务
+        logger.warning("集群模式下不支持SQLite持久化任务存储，使用内存存储")
+    elif SCHEDULER_JOBSTORE == 'sqlite':
+        jobstores[TASK_JOBSTORE] = SQLiteJobStore()
+        logger.info("*** 调度器使用SQLite持久化任务存储")
+    elif SCHEDULER_JOBSTORE != 'memory':
+        logger.warning(f"未知的任务存储类型: {SCHEDULER_JOBSTORE}，使用内存存储")
+    return jobstores
+
+def _create_executors():
+    """每种任务类型使用独立线程池，某个模型接口变慢时不会占满其他类型的线程"""
+    executors = {'default': MonitoredThreadPoolExecutor(SCHEDULER_POOL_SIZE, 'default')}
+    for task_type, size in SCHEDULER_TYPE_POOL_SIZES.items():
+        if size > 0:
+            executors[task_type] = MonitoredThreadPoolExecutor(size, task_type)
+    return executors
+
+TASK_JOBSTORE = 'tasks' if SCHEDULER_JOBSTORE == 'sqlite' and not CLUSTER_ENABLED else 'default'
+
+# 因错过补偿窗口或实例数达到上限而被丢弃的触发次数
+_dropped_fires = Counter()
+
+def _on_fire_dropped(event):
+    reason = 'missed' if event.code == EVENT_JOB_MISSED else 'max_instances'
+    _dropped_fires[reason] += 1
+    logger.warning(f"调度任务 {event.job_id} 的触发被丢弃: {reason}")
+
 # 初始化调度器
-scheduler = BackgroundScheduler()
+executors = _create_executors()
+scheduler = BackgroundScheduler(jobstores=_create_jobstores(), executors=executors)
+scheduler.add_listener(_on_fire_dropped, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
 scheduler.start()
 
-def update_scheduler():
-    """更新调度器任务"""
-    logger.info("*** 开始更新调度器任务...")
-    # 移除所有任务
-    for job in scheduler.get_jobs():
-        scheduler.remove_job(job.id)
+# 串行化调度器的增删改，避免并发对账时互相覆盖
+_reconcile_lock = threading.RLock()
+
+def _job_id(task_id):
+    return f"task_{task_id}"
+
+def _pregen_job_id(task_id):
+    return f"pregen_{task_id}"
+
+# 由任务对账管理的调度任务前缀
+_TASK_JOB_PREFIXES = ('task_', 'pregen_')
+
+_SECONDS_PER_DAY = 24 * 3600
+
+def parse_fire_time(cron_expression):
+    """将HH:MM:SS格式的执行时间解析为当天的秒数，格式无效时返回None"""
+    parts = (cron_expression or '').split(':')
+    if len(parts) != 3:
+        return None
+    try:
+        hour, minute, second = (int(part) for part in parts)
+    except ValueError:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        return None
+    return hour * 3600 + minute * 60 + second
+
+def _preferred_offset(task_id, window):
+    # 按任务ID确定性地选择窗口内的偏移量，重启或对账后保持不变
+    return zlib.crc32(str(task_id).encode('utf-8')) % (window + 1)
+
+def plan_fire_times(tasks, max_fires_per_second=SCHEDULER_MAX_FIRES_PER_SECOND):
+    """计算每个任务实际触发的时间（当天秒数）
+
+    未开启分散的任务按原时间触发；开启分散的任务按ID确定性地在 [原时间, 原时间+jitter_seconds]
+    窗口内选择触发秒，设置了每秒触发上限时会跳过已满的秒。窗口不会跨过午夜。
+    """
+    planned = {}
+    occupancy = Counter()
+    jittered = []
+    for task in tasks:
+        base = parse_fire_time(task.cron_expression)
+        if base is None:
+            continue
+        # 校验之前写入的无效值按不分散处理，不影响其他任务对账
+        window = min(int_field(task.jitter_seconds), _SECONDS_PER_DAY - 1 - base)
+        if window <= 0:
+            planned[task.id] = base
+            occupancy[base] += 1
+        else:
+            jittered.append((task.id, base, window))
     
-    # 添加所有启用的任务
-    tasks = execute_query("SELECT id, cron_expression, days_of_week FROM tasks WHERE enabled = 1")
-    logger.info(f"*** 共获取到 {len(tasks)} 个启用的任务！")
+    # 按ID顺序分配，新建任务不会挤占已有任务的触发时间
+    for task_id, base, window in sorted(jittered):
+        offset = _preferred_offset(task_id, window)
+        chosen = base + offset
+        if max_fires_per_second > 0:
+            candidates = [base + (offset + step) % (window + 1) for step in range(window + 1)]
+            free = [second for second in candidates if occupancy[second] < max_fires_per_second]
+            # 窗口内所有秒都已满时，选择最空闲的一秒
+            chosen = free[0] if free else min(candidates, key=lambda second: occupancy[second])
+        planned[task_id] = chosen
+        occupancy[chosen] += 1
+    return planned
+
+def build_trigger(task, fire_at=None):
+    """根据任务的执行时间和星期配置构建触发器，配置无效时返回None
+
+    fire_at为plan_fire_times计算出的当天秒数，未提供时使用任务配置的原时间。
+    """
+    if fire_at is None:
+        fire_at = parse_fire_time(task.cron_expression)
+    if fire_at is None:
+        logger.error(f"无效的cron表达式: {task.cron_expression}")
+        return None
+    return _cron_trigger(fire_at, task.days_of_week)
+
+def build_pregen_trigger(task, fire_at=None, lead_minutes=PREGENERATE_LEAD_MINUTES):
+    """构建提前生成内容的触发器：比任务触发时间早lead_minutes分钟，未开启预生成时返回None"""
+    if lead_minutes <= 0 or task.type not in PREGENERATE_TYPES:
+        return None
+    if fire_at is None:
+        fire_at = parse_fire_time(task.cron_expression)
+    if fire_at is None:
+        return None
+    # 提前量不超过一天；提前到前一天时星期配置也要前移一天
+    pregen_at = fire_at - min(lead_minutes * 60, _SECONDS_PER_DAY - 1)
+    day_shift = 0
+    if pregen_at < 0:
+        pregen_at += _SECONDS_PER_DAY
+        day_shift = 1
+    return _cron_trigger(pregen_at, task.days_of_week, day_shift)
+
+def _cron_trigger(fire_at, days_of_week, day_shift=0):
+    hour, remainder = divmod(fire_at, 3600)
+    minute, second = divmod(remainder, 60)
     
-    for task_info in tasks:
-        try:
-            task_id = task_info[0]
-            cron_expression = task_info[1]
-            days_of_week = task_info[2] if len(task_info) > 2 else ''
-            
-            # 解析cron表达式（格式：HH:MM:SS）
-            parts = cron_expression.split(':')
-            if len(parts) != 3:
-                logger.error(f"无效的cron表达式: {cron_expression}")
-                continue
-            
-            hour = int(parts[0])
-            minute = int(parts[1])
-            second = int(parts[2])
-            
-            # 设置触发器
-            if days_of_week:
-                # 按指定的星期几执行
-                selected_days = [int(day) for day in days_of_week.split(',') if day.isdigit()]
-                # 转换为APScheduler的星期表示（0-6，0表示周一）
-                aps_days = []
-                for day in selected_days:
-                    if day == 0:  # 0表示周日
-                        aps_days.append(6)
-                    else:
-                        aps_days.append(day - 1)
-                
-                # 将列表转换为APScheduler接受的格式：逗号分隔的字符串
-                aps_days_str = ','.join(map(str, aps_days))
-                
-                trigger = CronTrigger(
-                    second=second, minute=minute, hour=hour, 
-                    day_of_week=aps_days_str
-                )
+    # 设置触发器
+    if days_of_week:
+        # 按指定的星期几执行
+        selected_days = [int(day) for day in days_of_week.split(',') if day.isdigit()]
+        # 转换为APScheduler的星期表示（0-6，0表示周一）
+        aps_days = set()
+        for day in selected_days:
+            if day == 0:  # 0表示周日
+                aps_days.add((6 - day_shift) % 7)
             else:
-                # 每天执行
-                trigger = CronTrigger(
-                    second=second, minute=minute, hour=hour
-                )
-            
-            # 添加任务到调度器
-            scheduler.add_job(
-                execute_task, 
-                trigger, 
-                args=[task_id], 
-                id=f"task_{task_id}",
-                misfire_grace_time=300  # 允许5分钟的执行延迟
-            )
-            logger.info(f"*** 成功添加任务 {task_id} 到调度器")
-        except Exception as e:
-            logger.error(f"添加任务 {task_id} 到调度器失败: {str(e)}")
-    logger.info("*** 调度器任务更新完成！")
+                aps_days.add((day - 1 - day_shift) % 7)
+        
+        # 将列表转换为APScheduler接受的格式：逗号分隔的字符串
+        aps_days_str = ','.join(map(str, sorted(aps_days)))
+        
+        return CronTrigger(
+            second=second, minute=minute, hour=hour, 
+            day_of_week=aps_days_str
+        )
+    # 每天执行
+    return CronTrigger(
+        second=second, minute=minute, hour=hour
+    )
+
+def job_options(task):
+    """按任务类型生成调度参数：执行线程池、补偿窗口、是否合并错过的触发以及最大并发实例数"""
+    grace = SCHEDULER_MISFIRE_GRACE.get(task.type, SCHEDULER_MISFIRE_GRACE_DEFAULT)
+    return {
+        'executor': task.type if task.type in executors else 'default',
+        # APScheduler中None表示无论多晚都补偿，这里用1秒表示不补偿
+        'misfire_grace_time': grace if grace > 0 else 1,
+        'coalesce': SCHEDULER_COALESCE,
+        'max_instances': max(1, SCHEDULER_MAX_INSTANCES.get(task.type, SCHEDULER_MAX_INSTANCES_DEFAULT)),
+    }
+
+def _same_trigger(job, trigger):
+    # CronTrigger的字符串表示包含全部字段，可直接用于比较
+    return str(job.trigger) == str(trigger)
+
+def run_pregeneration(task_id):
+    """预生成任务：为该任务下一次触发提前生成内容"""
+    job = scheduler.get_job(_job_id(task_id))
+    if job is None or job.next_run_time is None:
+        return
+    pregenerate_content(task_id, job.next_run_time.timestamp())
+
+def _desired_jobs(task, fire_at=None):
+    """单个任务期望的调度任务：{job_id: (执行函数, 触发器, 调度参数)}"""
+    trigger = build_trigger(task, fire_at)
+    if trigger is None:
+        return {}
+    options = job_options(task)
+    jobs = {_job_id(task.id): (execute_task, trigger, options)}
+    pregen_trigger = build_pregen_trigger(task, fire_at)
+    if pregen_trigger is not None:
+        jobs[_pregen_job_id(task.id)] = (run_pregeneration, pregen_trigger, options)
+    return jobs
+
+def _apply(job_id, task_id, func, trigger, job, options=None):
+    """使单个调度任务的状态与期望一致，返回执行的动作"""
+    if trigger is None:
+        if job:
+            scheduler.remove_job(job_id)
+            return 'removed'
+        return None
+    options = options or {}
+    if job is None:
+        # 添加任务到调度器
+        scheduler.add_job(
+            func, 
+            trigger, 
+            args=[task_id], 
+            id=job_id,
+            jobstore=TASK_JOBSTORE,
+            **options
+        )
+        return 'added'
+    action = None
+    changed = {key: value for key, value in options.items() if getattr(job, key) != value}
+    if changed:
+        scheduler.modify_job(job_id, **changed)
+        action = 'modified'
+    if not _same_trigger(job, trigger):
+        scheduler.reschedule_job(job_id, trigger=trigger)
+        action = 'rescheduled'
+    return action
+
+def update_scheduler():
+    """对账调度器任务：只增删改发生变化的任务，不会清空调度器"""
+    logger.info("*** 开始对账调度器任务...")
+    with _reconcile_lock:
+        desired = {}
+        nodes = cluster.nodes()
+        tasks = get_enabled_tasks()
+        fire_times = plan_fire_times(tasks)
+        for task in tasks:
+            # 集群模式下只调度分配给本节点的任务；触发时间仍按全部任务规划，保证各节点结果一致
+            if not cluster.owns(task.id):
+                continue
+            for job_id, spec in _desired_jobs(task, fire_times.get(task.id)).items():
+                desired[job_id] = (task.id,) + spec
+        live = {job.id: job for job in scheduler.get_jobs() if job.id.startswith(_TASK_JOB_PREFIXES)}
+        
+        counts = {'added': 0, 'modified': 0, 'rescheduled': 0, 'removed': 0}
+        # 移除已删除、已禁用或配置无效的任务
+        for job_id in set(live) - set(desired):
+            scheduler.remove_job(job_id)
+            counts['removed'] += 1
+        
+        for job_id, (task_id, func, trigger, options) in desired.items():
+            try:
+                action = _apply(job_id, task_id, func, trigger, live.get(job_id), options)
+                if action:
+                    counts[action] += 1
+            except Exception as e:
+                logger.error(f"同步任务 {task_id} 到调度器失败: {str(e)}")
+        enabled_count = len({spec[0] for spec in desired.values()})
+        # 已移除不再归属本节点的任务，公布后其他节点才会接管
+        cluster.mark_applied(nodes)
+    
+    logger.info(f"*** 调度器对账完成！共 {enabled_count} 个启用的任务，"
+                f"新增 {counts['added']}，更新 {counts['rescheduled'] + counts['modified']}，移除 {counts['removed']}")
+    return counts
+
+def _shares_fire_capacity(tasks, max_fires_per_second=SCHEDULER_MAX_FIRES_PER_SECOND):
+    """是否有分散任务按每秒触发上限规划触发时间，此时单个任务的变化会影响其他任务"""
+    return max_fires_per_second > 0 and any(int_field(task.jitter_seconds) > 0 for task in tasks)
+
+def schedule_task(task_id):
+    """只同步单个任务的调度状态（创建、更新、启用/禁用后调用）"""
+    task = get_task_by_id(task_id)
+    tasks = get_enabled_tasks()
+    if _shares_fire_capacity(tasks):
+        # 设置了每秒触发上限时各分散任务的触发秒相互影响，任一任务变化都要整体重新规划
+        update_scheduler()
+        return 'reconciled'
+    desired = {}
+    if task and task.enabled and cluster.owns(task_id):
+        fire_at = plan_fire_times(tasks).get(task_id) if int_field(task.jitter_seconds) else None
+        desired = _desired_jobs(task, fire_at)
+    actions = []
+    with _reconcile_lock:
+        for job_id in (_job_id(task_id), _pregen_job_id(task_id)):
+            func, trigger, options = desired.get(job_id, (None, None, None))
+            action = _apply(job_id, task_id, func, trigger, scheduler.get_job(job_id), options)
+            if action:
+                actions.append(action)
+    # 以主任务的动作为准，预生成任务随之变化
+    action = actions[0] if actions else None
+    if action:
+        logger.info(f"*** 任务 {task_id} 调度状态已同步: {action}")
+    return action
+
+def unschedule_task(task_id):
+    """从调度器中移除单个任务（删除后调用）"""
+    if _shares_fire_capacity(get_enabled_tasks()):
+        # 释放的触发秒可能让其他分散任务回到首选时间，整体重新规划
+        return bool(update_scheduler()['removed'])
+    with _reconcile_lock:
+        if scheduler.get_job(_pregen_job_id(task_id)):
+            scheduler.remove_job(_pregen_job_id(task_id))
+        if scheduler.get_job(_job_id(task_id)):
+            scheduler.remove_job(_job_id(task_id))
+            logger.info(f"*** 已从调度器移除任务 {task_id}")
+            return True
+    return False
+
+def _on_cluster_change(nodes_changed, tasks_changed):
+    """节点增减时重新分配任务；其他节点修改了任务时重新加载任务缓存"""
+    if tasks_changed:
+        task_registry.invalidate()
+    update_scheduler()
+
+def start_cluster():
+    """开启集群模式时注册本节点并启动心跳，需在init_db之后、首次对账之前调用"""
+    if not CLUSTER_ENABLED:
+        return
+    cluster.start(_on_cluster_change)
+    atexit.register(cluster.stop)
+
+def _run_on_leader(func):
+    # 集群模式下维护任务只在主节点执行
+    if cluster.is_leader():
+        func()
+
+def register_maintenance_jobs():
+    """注册日志清理、VACUUM、未发送消息接管等维护任务"""
+    if LOG_RETENTION_INTERVAL_MINUTES > 0:
+        scheduler.add_job(
+            _run_on_leader,
+            'interval',
+            args=[run_retention],
+            minutes=LOG_RETENTION_INTERVAL_MINUTES,
+            id='maintenance_log_retention',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        logger.info(f"*** 已注册日志清理任务，间隔 {LOG_RETENTION_INTERVAL_MINUTES} 分钟")
+    if LOG_VACUUM_INTERVAL_HOURS > 0:
+        scheduler.add_job(
+            _run_on_leader,
+            'interval',
+            args=[vacuum],
+            hours=LOG_VACUUM_INTERVAL_HOURS,
+            id='maintenance_vacuum',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        logger.info(f"*** 已注册数据库VACUUM任务，间隔 {LOG_VACUUM_INTERVAL_HOURS} 小时")
+    if OUTBOX_RECOVERY_INTERVAL_SECONDS > 0:
+        # 每个节点都执行，接管已下线节点未发送的消息
+        scheduler.add_job(
+            delivery_queue.recover,
+            'interval',
+            seconds=OUTBOX_RECOVERY_INTERVAL_SECONDS,
+            id='maintenance_outbox_recovery',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        logger.info(f"*** 已注册未发送消息接管任务，间隔 {OUTBOX_RECOVERY_INTERVAL_SECONDS} 秒")
+
+def get_scheduler_stats():
+    """调度器状态：各线程池的排队和等待时间、被丢弃的触发次数、预生成内容缓存、大模型客户端、回复缓存、各模型调用耗时和排队情况以及集群节点"""
+    return {
+        'running': scheduler.running,
+        'jobs': len(scheduler.get_jobs()),
+        'executors': [executor.stats() for executor in executors.values()],
+        'dropped_fires': dict(_dropped_fires),
+        'content_cache': content_cache.stats(),
+        'llm_clients': llm_clients.stats(),
+        'llm_cache': completion_cache.stats(),
+        'llm_metrics': llm_metrics.stats(),
+        'llm_limiter': llm_limiter.stats(),
+        'cluster': cluster.stats(),
+    }
@@ -1,7 +1,129 @@
+import queue
+import atexit
+import threading
+from time import monotonic
 import requests
-from openai import OpenAI
+from collections import OrderedDict
+from contextlib import contextmanager
+from openai import OpenAI, Timeout
 from datetime import datetime
+from services.completion_cache import completion_cache, completion_key
+from services.llm_metrics import llm_metrics
+from services.llm_limiter import llm_limiter, provider_host
 from utils.logger import logger
+from utils.config import (LLM_CLIENT_CACHE_SIZE, LLM_CONNECT_TIMEOUT, LLM_TIMEOUT, LLM_MAX_RETRIES,
+                          LLM_PROVIDER_TIMEOUTS, LLM_PROVIDER_RETRIES, LLM_STREAM, LLM_DEADLINE_SECONDS,
+                          LLM_MAX_TOKENS, LLM_DEADLINE_PARTIAL, LLM_STREAM_USAGE, LLM_QUEUE_TIMEOUT, LLM_HEDGE,
+                          LLM_HEDGE_DELAY, LLM_HEDGE_MIN_SAMPLES)
+
+def _mask_key(api_key):
+    return f"***{api_key[-4:]}" if api_key and len(api_key) > 8 else '***'
+
+class _CachedClient:
+    __slots__ = ('client', 'provider', 'api_key', 'uses', 'in_use', 'evicted')
+
+    def __init__(self, client, provider, api_key):
+        self.client = client
+        self.provider = provider
+        self.api_key = api_key
+        self.uses = 0
+        self.in_use = 0
+        self.evicted = False
+
+class LLMClientRegistry:
+    """大模型客户端缓存
+
+    每个OpenAI客户端持有自己的httpx连接池，按 (API地址, API Key) 缓存复用，
+    同一服务商的多次调用复用已建立的连接和TLS会话。缓存数量有上限，超出时淘汰最久未使用的客户端，
+    被淘汰的客户端在正在进行的请求结束后关闭。超时和重试次数可按服务商主机名单独配置。
+    """
+
+    def __init__(self, max_clients=LLM_CLIENT_CACHE_SIZE):
+        self.max_clients = max(1, max_clients)
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self.created = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def _create(self, api_url, api_key):
+        provider = provider_host(api_url)
+        timeout = LLM_PROVIDER_TIMEOUTS.get(provider, LLM_TIMEOUT)
+        client = OpenAI(
+            api_key=api_key,
+            base_url=api_url,
+            timeout=Timeout(timeout, connect=min(LLM_CONNECT_TIMEOUT, timeout)),
+            max_retries=LLM_PROVIDER_RETRIES.get(provider, LLM_MAX_RETRIES),
+        )
+        return _CachedClient(client, provider, api_key)
+
+    @contextmanager
+    def client(self, api_url, api_key):
+        """取出（必要时创建）对应的客户端，使用期间不会被关闭"""
+        key = (api_url, api_key)
+        evicted = []
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = self._clients[key] = self._create(api_url, api_key)
+                self.created += 1
+                while len(self._clients) > self.max_clients:
+                    _, old = self._clients.popitem(last=False)
+                    old.evicted = True
+                    self.evictions += 1
+                    if not old.in_use:
+                        evicted.append(old)
+            entry.uses += 1
+            entry.in_use += 1
+        for old in evicted:
+            self._close(old)
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                close = entry.evicted and not entry.in_use
+            if close:
+                self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry.client.close()
+        except Exception as e:
+            logger.warning(f"关闭大模型客户端失败 ({entry.provider}): {str(e)}")
+
+    def close(self):
+        """关闭全部缓存的客户端"""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+            for entry in entries:
+                entry.evicted = True
+        for entry in entries:
+            if not entry.in_use:
+                self._close(entry)
+
+    def stats(self):
+        """客户端缓存状态，不包含完整的API Key"""
+        with self._lock:
+            return {
+                'max_clients': self.max_clients,
+                'created': self.created,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'clients': [{
+                    'provider': entry.provider,
+                    'api_key': _mask_key(entry.api_key),
+                    'uses': entry.uses,
+                    'in_use': entry.in_use,
+                } for entry in self._clients.values()],
+            }
+
+llm_clients = LLMClientRegistry()
+atexit.register(llm_clients.close)
 
 def get_ai_news(url="http://127.0.0.1:4399/v2/ai-news"):
     """获取AI新闻"""
@@ -29,23 +151,266 @@ def get_ai_news(url="http://127.0.0.1:4399/v2/ai-news"):
         logger.error(f"获取新闻失败: {str(e)}")
         return False, f"获取新闻失败: {str(e)}"
 
-def call_llm(api_url, api_key, prompt, model_name='deepseek-chat'):
-    """调用大模型"""
-    logger.info(f"调用大模型，API URL: {api_url}, 模型: {model_name}")
+# 系统提示词，{time}替换为调用时的系统时间
+SYSTEM_PROMPT = "# 角色\n你是一位AI智能播报助手,能够根据要求播报内容。\n\n# 要求\n语言幽默，建议使用emoji # 系统时间:{time}"
+
+# 流式生成超过截止时间、发送已生成的内容时附加的提示
+TRUNCATED_NOTE = "\n\n（生成超时，内容可能不完整）"
+
+_CANCELLED = "调用大模型已取消: 其他候选已返回结果"
+
+class _Cancellation:
+    """取消一次进行中的调用：流式生成时立即关闭连接，非流式请求结束后丢弃结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"取消大模型调用失败: {str(e)}")
+
+def _candidates(api_url, api_key, model_name, fallbacks):
+    # 备用项未填写api_url或与主服务商地址相同时沿用主服务商的API Key，填写了其他地址时不会带上主服务商的API Key
+    candidates = [(api_url, api_key, model_name)]
+    for fallback in fallbacks or ():
+        if not isinstance(fallback, dict):
+            continue
+        same_provider = fallback.get('api_url') in (None, '', api_url)
+        candidates.append((
+            fallback.get('api_url') or api_url,
+            fallback.get('api_key') or (api_key if same_provider else None),
+            fallback.get('model_name') or model_name,
+        ))
+    return candidates
+
+def call_llm(api_url, api_key, prompt, model_name='deepseek-chat', max_tokens=None, deadline=None, fallbacks=None):
+    """调用大模型，开启回复缓存时相同的请求共用一次调用结果
+
+    max_tokens为最大输出token数，deadline为整体截止时间（秒），为空或0时使用全局配置。
+    fallbacks为备用的 [{'api_url', 'api_key', 'model_name'}] 列表，按顺序对冲和故障切换。
+    """
+    max_tokens = max_tokens or LLM_MAX_TOKENS or None
+    deadline = deadline or LLM_DEADLINE_SECONDS or None
+    candidates = _candidates(api_url, api_key, model_name, fallbacks)
+    truncated = []
+
+    def generate():
+        if len(candidates) > 1:
+            success, content, was_truncated = _complete_hedged(candidates, prompt, max_tokens, deadline)
+        else:
+            success, content, was_truncated = _complete(api_url, api_key, prompt, model_name, max_tokens, deadline)
+        if was_truncated:
+            truncated.append(True)
+        return success, content
+
+    key = completion_key(api_url, model_name, SYSTEM_PROMPT, prompt, max_tokens,
+                         [(candidate[0], candidate[2]) for candidate in candidates[1:]])
+    return completion_cache.get_or_call(key, generate, cacheable=lambda result: not truncated, timeout=deadline)
+
+def _hedge_delay(model_name):
+    """等待多久未返回时发起对冲请求，None表示不对冲"""
+    if not LLM_HEDGE:
+        return None
+    p95 = llm_metrics.total_p95(model_name, LLM_HEDGE_MIN_SAMPLES)
+    return LLM_HEDGE_DELAY if p95 is None else p95
+
+def _complete_hedged(candidates, prompt, max_tokens=None, deadline=None):
+    """按顺序调用多个候选服务商/模型，返回最先成功的结果
+
+    当前请求出错时立即请求下一个候选；超过该模型的p95耗时仍未返回时，同时请求下一个候选，
+    取最先成功返回的结果并取消其余请求。全部失败时返回最后一个错误。
+    """
+    deadline_at = monotonic() + deadline if deadline else None
+    results = queue.Queue()
+    running = {}
+    state = {'next': 0, 'launched_at': 0.0}
+
+    def launch():
+        index = state['next']
+        state['next'] += 1
+        api_url, api_key, model_name = candidates[index]
+        cancel = running[index] = _Cancellation()
+        remaining = None if deadline_at is None else max(0.1, deadline_at - monotonic())
+
+        def run():
+            try:
+                result = _complete(api_url, api_key, prompt, model_name, max_tokens, remaining, cancel)
+            except Exception as e:
+                result = (False, f"调用大模型失败: {str(e)}", False)
+            results.put((index, result))
+
+        threading.Thread(target=run, name=f'llm-candidate-{index}', daemon=True).start()
+        state['launched_at'] = monotonic()
+
+    launch()
+    result = (False, "调用大模型失败: 没有可用的候选", False)
+    while running:
+        wait = None
+        if state['next'] < len(candidates):
+            delay = _hedge_delay(candidates[state['next'] - 1][2])
+            if delay is not None:
+                wait = max(0.0, state['launched_at'] + delay - monotonic())
+        try:
+            index, result = results.get(timeout=wait)
+        except queue.Empty:
+            model_name = candidates[state['next'] - 1][2]
+            llm_metrics.record_hedged(model_name)
+            logger.warning(f"大模型 {model_name} 超过p95耗时仍未返回，同时请求备用候选 {candidates[state['next']][2]}")
+            launch()
+            continue
+        running.pop(index, None)
+        if result[0]:
+            for cancel in running.values():
+                cancel.cancel()
+            if index > 0:
+                logger.info(f"使用备用候选 {candidates[index][2]} 的结果")
+            return result
+        if state['next'] < len(candidates) and (deadline_at is None or monotonic() < deadline_at):
+            llm_metrics.record_failover(candidates[index][2])
+            logger.warning(f"大模型 {candidates[index][2]} 调用失败，切换到备用候选 {candidates[state['next']][2]}")
+            launch()
+    return result
+
+def _complete(api_url, api_key, prompt, model_name, max_tokens=None, deadline=None, cancel=None):
+    """调用一次大模型，返回 (是否成功, 内容, 是否因超过截止时间被截断)"""
+    logger.info(f"调用大模型，API URL: {api_url}, 模型: {model_name}" + (", 流式生成" if LLM_STREAM else ""))
+    deadline_at = monotonic() + deadline if deadline else None
+    # 按API地址排队，等待时间计入截止时间
+    queue_timeout = min(LLM_QUEUE_TIMEOUT, deadline) if deadline else LLM_QUEUE_TIMEOUT
+    if not llm_limiter.acquire(api_url, queue_timeout):
+        llm_metrics.record(model_name, False, queue_timeout)
+        logger.error(f"调用大模型失败: 排队等待超过 {queue_timeout} 秒")
+        return False, f"调用大模型失败: 排队等待超过 {queue_timeout} 秒", False
+    if cancel is not None and cancel.cancelled:
+        llm_limiter.release(api_url, False)
+        return False, _CANCELLED, False
+    start = monotonic()
+    options = {'max_tokens': max_tokens} if max_tokens else {}
+    success, status_code, retry_after = False, None, None
     try:
-        client = OpenAI(api_key=api_key, base_url=api_url)
         time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": f"# 角色\n你是一位AI智能播报助手,能够根据要求播报内容。\n\n# 要求\n语言幽默，建议使用emoji # 系统时间:{time}"},
-                {"role": "user", "content": prompt},
-            ],
-            stream=False
-        )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT.format(time=time)},
+            {"role": "user", "content": prompt},
+        ]
+        with llm_clients.client(api_url, api_key) as client:
+            if deadline_at is not None:
+                # 设置了截止时间时不自动重试，请求超时不超过剩余时间
+                remaining = max(0.1, deadline_at - start)
+                client = client.with_options(
+                    timeout=Timeout(remaining, connect=min(LLM_CONNECT_TIMEOUT, remaining)), max_retries=0
+                )
+            if LLM_STREAM:
+                result = _stream_completion(client, model_name, messages, options, start, deadline, deadline_at, cancel)
+                success = result[0]
+                return result
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                stream=False,
+                **options
+            )
 
+        if cancel is not None and cancel.cancelled:
+            return False, _CANCELLED, False
+        usage = getattr(response, 'usage', None)
+        llm_metrics.record(model_name, True, monotonic() - start,
+                           tokens=getattr(usage, 'completion_tokens', None))
         logger.info("大模型调用成功")
-        return True, response.choices[0].message.content
+        success = True
+        return True, response.choices[0].message.content, False
     except Exception as e:
+        if cancel is not None and cancel.cancelled:
+            return False, _CANCELLED, False
+        status_code, retry_after = _error_status(e)
+        llm_metrics.record(model_name, False, monotonic() - start)
         logger.error(f"调用大模型失败: {str(e)}")
-        return False, f"调用大模型失败: {str(e)}"
+        return False, f"调用大模型失败: {str(e)}", False
+    finally:
+        llm_limiter.release(api_url, success, status_code, retry_after)
+
+def _error_status(error):
+    """从OpenAI SDK的异常中取出HTTP状态码和Retry-After秒数"""
+    status_code = getattr(error, 'status_code', None)
+    retry_after = None
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            retry_after = None
+    return status_code, retry_after
+
+def _stream_completion(client, model_name, messages, options, start, deadline, deadline_at, cancel=None):
+    """流式接收回复，超过截止时间时关闭连接，按配置发送已生成的内容或视为失败"""
+    if LLM_STREAM_USAGE:
+        # 请求在最后一段返回token用量，输出速度按实际输出token数计算；服务商未返回时按分段数估算
+        options = dict(options, stream_options={'include_usage': True})
+    stream = client.chat.completions.create(model=model_name, messages=messages, stream=True, **options)
+    expired = threading.Event()
+    if cancel is not None:
+        cancel.on_cancel(stream.close)
+
+    def expire():
+        expired.set()
+        stream.close()
+
+    timer = None
+    if deadline_at is not None:
+        # 在另一个线程中到时关闭连接，正在等待的读取会立即返回
+        timer = threading.Timer(max(0.0, deadline_at - monotonic()), expire)
+        timer.daemon = True
+        timer.start()
+    parts = []
+    ttft = tokens = None
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, 'usage', None)
+            if usage is not None and usage.completion_tokens:
+                tokens = usage.completion_tokens
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if ttft is None:
+                    ttft = monotonic() - start
+                parts.append(text)
+    except Exception:
+        if not expired.is_set() and not (cancel is not None and cancel.cancelled):
+            raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        stream.close()
+
+    total = monotonic() - start
+    content = ''.join(parts)
+    if cancel is not None and cancel.cancelled:
+        return False, _CANCELLED, False
+    if expired.is_set():
+        if not content or not LLM_DEADLINE_PARTIAL:
+            llm_metrics.record(model_name, False, total)
+            logger.error(f"调用大模型超时: 超过 {deadline} 秒，已收到 {len(content)} 个字符")
+            return False, f"调用大模型超时: 超过 {deadline} 秒", False
+        llm_metrics.record(model_name, True, total, ttft, tokens or len(parts), truncated=True)
+        logger.warning(f"调用大模型超过 {deadline} 秒，发送已生成的 {len(content)} 个字符")
+        return True, content + TRUNCATED_NOTE, True
+
+    llm_metrics.record(model_name, True, total, ttft, tokens or len(parts))
+    logger.info(f"大模型调用成功，首个token耗时 {ttft or 0:.2f} 秒，总耗时 {total:.2f} 秒")
+    return True, content, False
@@ -0,0 +1,114 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from utils.logger import logger
+from utils.config import LLM_CACHE_TTL_SECONDS, LLM_CACHE_SIZE, LLM_CACHE_BUCKET_SECONDS
+
+def completion_key(*parts):
+    """由服务商、模型和提示词等生成缓存键，提示词较长，只保存摘要"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class _Flight:
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = (False, "调用大模型失败: 请求未完成")
+        self.waiters = 0
+
+class CompletionCache:
+    """大模型回复缓存
+
+    多个任务向同一服务商、同一模型发送相同提示词时共用一次调用结果。缓存键包含时间段编号
+    （按bucket_seconds划分），不同时间段的相同提示词重新生成；成功的回复保存ttl秒，数量超过上限时
+    淘汰最久未使用的。相同的请求正在调用时，后来的请求等待这次调用完成并直接使用其结果（成功或失败），
+    不会同时调用大模型。ttl为0时不缓存。
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_SIZE, bucket_seconds=LLM_CACHE_BUCKET_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.wait_timeouts = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get_or_call(self, key, func, cacheable=None, timeout=None):
+        """返回key对应的缓存结果，没有时调用func()生成 (是否成功, 内容)
+
+        只缓存成功的结果；cacheable(结果)返回False时本次结果也不缓存（例如超时截断的内容）。
+        timeout为等待相同请求结果的最长秒数（调用方剩余的截止时间），超时后直接返回失败。
+        """
+        if not self.enabled:
+            return func()
+        now = time.time()
+        if self.bucket_seconds > 0:
+            key = (key, int(now // self.bucket_seconds))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                self.misses += 1
+            else:
+                flight.waiters += 1
+                self.shared += 1
+        if not leader:
+            logger.info("相同的大模型请求正在进行，等待其结果")
+            if not flight.event.wait(timeout):
+                with self._lock:
+                    self.wait_timeouts += 1
+                logger.warning(f"等待相同大模型请求的结果超过 {timeout} 秒，放弃等待")
+                return False, "调用大模型失败: 等待相同请求的结果超时"
+            return flight.result
+
+        try:
+            flight.result = func()
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                success, content = flight.result
+                if success and (cacheable is None or cacheable(flight.result)):
+                    self._entries[key] = (time.time() + self.ttl, content)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.event.set()
+        return flight.result
+
+    def stats(self):
+        """缓存状态：命中、未命中以及等待相同请求结果的次数"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'wait_timeouts': self.wait_timeouts,
+                'hit_rate': round((self.hits + self.shared) / lookups, 3) if lookups else None,
+            }
+
+completion_cache = CompletionCache()
@@ -0,0 +1,60 @@
+import time
+import threading
+from utils.logger import logger
+from utils.config import PREGENERATE_EARLY_SECONDS, PREGENERATE_MAX_LATE_SECONDS
+
+class ContentCache:
+    """预生成内容缓存
+
+    以 (任务ID, 目标触发时间) 保存提前生成的消息内容。只有在目标触发时间附近取用时才会命中：
+    早于触发时间超过early_seconds（例如提前手动执行）或晚于触发时间超过max_late_seconds
+    （内容已过期）时都视为未命中，由调用方实时生成。
+    """
+
+    def __init__(self, early_seconds=PREGENERATE_EARLY_SECONDS, max_late_seconds=PREGENERATE_MAX_LATE_SECONDS):
+        self.early_seconds = early_seconds
+        self.max_late_seconds = max_late_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, task_id, fire_time, content):
+        """保存任务在fire_time（时间戳）触发时要发送的内容"""
+        with self._lock:
+            self._purge(time.time())
+            self._entries[task_id] = (fire_time, content, time.time())
+        logger.debug(f"已缓存任务 {task_id} 的预生成内容，目标触发时间 {fire_time}")
+
+    def take(self, task_id, now=None):
+        """取出并移除当前时间可用的预生成内容，没有可用内容时返回None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(task_id)
+            if entry and entry[0] - self.early_seconds <= now:
+                del self._entries[task_id]
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def discard(self, task_id):
+        """丢弃任务的预生成内容，任务被修改或删除后调用，避免发送按旧配置生成的内容"""
+        with self._lock:
+            if self._entries.pop(task_id, None) is not None:
+                logger.debug(f"已丢弃任务 {task_id} 的预生成内容")
+
+    def stats(self):
+        """缓存状态"""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _purge(self, now):
+        expired = [task_id for task_id, (fire_time, _, _) in self._entries.items()
+                   if fire_time + self.max_late_seconds < now]
+        for task_id in expired:
+            del self._entries[task_id]
+            logger.warning(f"任务 {task_id} 的预生成内容已过期，已丢弃")
+
+content_cache = ContentCache()
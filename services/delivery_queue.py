@@ -0,0 +1,237 @@
+import time
+import heapq
+import queue
+import itertools
+import atexit
+import threading
+from collections import deque
+from services.feishu_service import render_feishu_message, post_feishu_request
+from services.rate_limiter import webhook_rate_limiter
+from services.outbox import outbox, OutboxMessage, backoff_delay, SENT, DEAD
+from services.log_service import add_log
+from utils.stats import percentile
+from utils.logger import logger
+from utils.config import DELIVERY_WORKERS, DELIVERY_QUEUE_SIZE, OUTBOX_MAX_ATTEMPTS
+
+_STOP = object()
+
+def _log_recovered(task_id):
+    """重启后恢复的消息已没有原调用方的回调，发送结果直接记录到任务日志"""
+    def callback(success, result, elapsed):
+        if task_id is not None:
+            add_log(task_id, "成功" if success else "失败", "补发消息成功" if success else f"补发消息失败: {result}")
+    return callback
+
+class DeliveryQueue:
+    """异步飞书消息发送队列
+
+    调用方（定时任务、Webhook请求）只把渲染好的消息放入内存队列后立即返回，
+    由workers个发送线程并发发送。发送完成后在发送线程中回调
+    callback(是否成功, 结果信息, 发送耗时秒数)，由调用方记录日志。
+    超出webhook发送频率或被飞书限流的消息放入延迟队列，到可发送时间后重新入队，
+    不会占用发送线程等待。每条消息同时记录在outbox表中：发送失败后按指数退避重试，
+    超过最大发送次数后转为死信才回调失败；进程重启后由recover恢复未发送的消息。
+    """
+
+    def __init__(self, workers=DELIVERY_WORKERS, max_pending=DELIVERY_QUEUE_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._queue = queue.Queue(maxsize=max(0, max_pending))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.recovered = 0
+        self._recent_waits = deque(maxlen=500)
+        # 延迟发送的消息：(到期时间, 序号, 消息)
+        self._delayed = []
+        self._delayed_cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._stopping = False
+
+    def start(self):
+        """启动发送线程"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            outbox.start()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'delivery-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._run_delayed, name='delivery-delayed', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"*** 消息发送线程已启动，共 {self.workers} 个")
+
+    def stop(self, timeout=10):
+        """停止发送线程：发送完已到期的消息，等待中的消息保留在outbox中，下次启动时恢复"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        deadline = time.monotonic() + timeout
+        workers, delayed_thread = threads[:-1], threads[-1]
+        with self._delayed_cond:
+            self._stopping = True
+            self._delayed_cond.notify()
+        delayed_thread.join(max(0, deadline - time.monotonic()))
+        for _ in workers:
+            self._queue.put(_STOP)
+        for thread in workers:
+            thread.join(max(0, deadline - time.monotonic()))
+        outbox.stop()
+        logger.info("消息发送线程已停止")
+
+    def enqueue(self, webhook_url, body, callback=None, task_id=None):
+        """放入一条已渲染的消息，立即返回是否入队成功；队列已满时转为死信并同步回调失败结果"""
+        message = OutboxMessage(webhook_url, body, task_id=task_id, callback=callback)
+        # 先记录pending状态再入队，保证发送线程写入的sent状态排在其后，不会被覆盖回pending
+        outbox.save(message)
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.error(f"消息发送队列已满，丢弃发送到 {webhook_url} 的消息")
+            message.status, message.last_error = DEAD, "发送队列已满"
+            outbox.save(message)
+            self._notify(callback, False, "消息发送失败: 发送队列已满", 0.0)
+            return False
+        return True
+
+    def send(self, webhook_url, content, callback=None, task_id=None):
+        """渲染消息文本并放入发送队列"""
+        return self.enqueue(webhook_url, render_feishu_message(content), callback, task_id)
+
+    def recover(self, include_own=False):
+        """从outbox接管未发送的消息并按原定的下次发送时间重新排队，返回接管条数"""
+        messages = outbox.claim_pending(include_own)
+        now = time.time()
+        for message in messages:
+            message.callback = _log_recovered(message.task_id)
+            self._defer(message, max(0.0, (message.next_attempt_at or now) - now))
+        with self._lock:
+            self.recovered += len(messages)
+        return len(messages)
+
+    def retry_dead_letter(self, message_id):
+        """重新发送一条死信消息，返回是否找到该消息"""
+        message = outbox.revive(message_id)
+        if message is None:
+            return False
+        message.callback = _log_recovered(message.task_id)
+        self._defer(message, 0)
+        return True
+
+    def _notify(self, callback, success, result, elapsed):
+        if callback is None:
+            return
+        try:
+            callback(success, result, elapsed)
+        except Exception as e:
+            logger.error(f"消息发送结果回调失败: {str(e)}")
+
+    def _defer(self, message, delay):
+        with self._delayed_cond:
+            if self._stopping:
+                # 正在退出，消息已记录在outbox中，下次启动时恢复
+                return
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), message))
+            self._delayed_cond.notify()
+
+    def _run_delayed(self):
+        # 将到期的延迟消息放回发送队列
+        while True:
+            with self._delayed_cond:
+                while True:
+                    if self._stopping:
+                        return
+                    now = time.monotonic()
+                    if self._delayed and self._delayed[0][0] <= now:
+                        message = heapq.heappop(self._delayed)[2]
+                        break
+                    self._delayed_cond.wait(self._delayed[0][0] - now if self._delayed else None)
+            self._queue.put(message)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is _STOP:
+                return
+            webhook_url = message.webhook_url
+            # 按webhook限流，每条消息只预约一次发送时间；需要等待时放入延迟队列，发送线程继续处理其他消息
+            if message.reserved:
+                wait = webhook_rate_limiter.paused_for(webhook_url)
+            else:
+                wait = webhook_rate_limiter.reserve(webhook_url)
+                message.reserved = True
+            if wait > 0:
+                self._defer(message, wait)
+                continue
+
+            start = time.monotonic()
+            with self._lock:
+                self._in_flight += 1
+                if message.attempts == 0:
+                    self._recent_waits.append(start - message.enqueued_at)
+            try:
+                success, result, rate_limited = post_feishu_request(webhook_url, message.body)
+            except Exception as e:
+                success, result, rate_limited = False, f"消息发送失败: {str(e)}", False
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._in_flight -= 1
+
+            message.attempts += 1
+            if success:
+                message.status, message.last_error = SENT, None
+            else:
+                message.last_error = result
+                if message.attempts >= self.max_attempts:
+                    message.status = DEAD
+                    logger.error(f"消息 {message.id} 发送 {message.attempts} 次均失败，已转为死信: {result}")
+            if not success and message.status != DEAD:
+                # 被飞书限流时按限流器的暂停时间重试，其他错误按指数退避重试
+                delay = webhook_rate_limiter.paused_for(webhook_url) if rate_limited else backoff_delay(message.attempts)
+                message.next_attempt_at = time.time() + delay
+                message.reserved = False
+                outbox.save(message)
+                with self._lock:
+                    self.retried += 1
+                logger.warning(f"消息 {message.id} 第 {message.attempts} 次发送失败，{delay:.1f} 秒后重试: {result}")
+                self._defer(message, delay)
+                continue
+
+            outbox.save(message)
+            with self._lock:
+                if success:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            self._notify(message.callback, success, result, elapsed)
+
+    def stats(self):
+        """发送队列状态，等待时间单位为秒"""
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            return {
+                'workers': self.workers,
+                'pending': self._queue.qsize(),
+                'delayed': len(self._delayed),
+                'in_flight': self._in_flight,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'rejected': self.rejected,
+                'recovered': self.recovered,
+                'wait_p95': round(percentile(waits, 95), 3),
+            }
+
+delivery_queue = DeliveryQueue()
+delivery_queue.start()
+atexit.register(delivery_queue.stop)
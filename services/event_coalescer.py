@@ -0,0 +1,180 @@
+import time
+import atexit
+import threading
+from collections import Counter
+from datetime import datetime
+from models.task import int_field
+from services.delivery_queue import delivery_queue
+from utils.logger import logger
+from utils.config import GIT_COALESCE_MAX_DELAY_SECONDS, GIT_COALESCE_TOP_COMMITS
+
+# 参与合并的推送事件类型，其余事件立即发送
+PUSH_EVENTS = {'gitlab': 'Push Hook', 'github': 'push'}
+_SOURCE_NAMES = {'gitlab': 'GitLab', 'github': 'GitHub'}
+
+def summarize_push(source, event_data):
+    """提取推送事件中汇总需要的字段"""
+    if source == 'gitlab':
+        project_name = event_data.get('project', {}).get('name', '未知项目')
+        user_name = event_data.get('user_name', '未知用户')
+    else:
+        project_name = event_data.get('repository', {}).get('name', '未知项目')
+        user_name = event_data.get('pusher', {}).get('name', '未知用户')
+    commits = event_data.get('commits', [])
+    return {
+        'project': project_name,
+        'user': user_name,
+        'branch': event_data.get('ref', '').split('/')[-1],
+        'commit_count': event_data.get('total_commits_count', len(commits)) or len(commits),
+        'commits': [(
+            commit.get('author', {}).get('name', '未知作者'),
+            commit.get('message', '').split('\n')[0],
+            commit.get('url', '')
+        ) for commit in commits],
+    }
+
+def render_digest(source, pushes, top_commits=GIT_COALESCE_TOP_COMMITS):
+    """将同一项目的多次推送渲染为一条汇总消息"""
+    users = list(dict.fromkeys(push['user'] for push in pushes))
+    branches = Counter(push['branch'] for push in pushes)
+    commit_total = sum(push['commit_count'] for push in pushes)
+    commits = [commit for push in pushes for commit in push['commits']]
+
+    branch_text = '、'.join(f"{branch} ({count} 次)" for branch, count in branches.most_common())
+    message = f"🚀 **{_SOURCE_NAMES[source]} Push汇总**\n"
+    message += f"📦 项目: {pushes[0]['project']}\n"
+    message += f"🔁 推送: {len(pushes)} 次，共 {commit_total} 个新提交，{len(users)} 位用户\n"
+    message += f"👤 用户: {'、'.join(users)}\n"
+    message += f"🌿 分支: {branch_text}\n"
+    if commits:
+        # 展示最新的几个提交
+        lines = []
+        for author, commit_message, url in reversed(commits[-top_commits:]):
+            lines.append(f"  • [{author}]: {commit_message}")
+            if url:
+                lines.append(f"    🔗 {url}")
+        if len(commits) > top_commits:
+            lines.append(f"  • ... 还有 {len(commits) - top_commits} 个提交")
+        message += "📋 最新提交:\n" + '\n'.join(lines) + "\n"
+    message += f"⏰ 时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    return message
+
+class _Burst:
+    __slots__ = ('source', 'task_id', 'webhook_url', 'make_callback', 'messages', 'pushes',
+                 'first_at', 'deadline')
+
+    def __init__(self, source, task_id, webhook_url, make_callback, now):
+        self.source = source
+        self.task_id = task_id
+        self.webhook_url = webhook_url
+        self.make_callback = make_callback
+        self.messages = []
+        self.pushes = []
+        self.first_at = now
+        self.deadline = now
+
+class EventCoalescer:
+    """Git推送事件合并器
+
+    任务设置了合并窗口（coalesce_seconds）时，同一任务、同一项目的推送事件先缓存起来：
+    每来一个事件，发送时间推迟到该事件之后coalesce_seconds秒，但不晚于第一个事件之后max_delay秒。
+    到时间后窗口内只有一个事件则按原格式发送，有多个事件则合并为一条汇总消息。
+    缓存只在内存中，进程退出前会立即发送。
+    """
+
+    def __init__(self, max_delay=GIT_COALESCE_MAX_DELAY_SECONDS):
+        self.max_delay = max(1, max_delay)
+        self._cond = threading.Condition()
+        self._bursts = {}
+        self._thread = None
+        self._stopping = False
+        self.digests = 0
+        self.coalesced_events = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='event-coalescer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """立即发送全部缓存的事件并停止"""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout)
+
+    def submit(self, task, source, event_type, event_data, message, make_callback):
+        """提交一个已解析的事件
+
+        make_callback(事件数)返回记录发送结果的回调。未开启合并或不是推送事件时立即放入发送队列。
+        """
+        # 无效的合并窗口按未开启处理，不影响同一请求中的其他任务
+        window = int_field(task.coalesce_seconds)
+        if window <= 0 or PUSH_EVENTS.get(source) != event_type or self._thread is None:
+            delivery_queue.send(task.webhook_url, message, make_callback(1), task.id)
+            return
+        push = summarize_push(source, event_data)
+        key = (task.id, push['project'])
+        now = time.monotonic()
+        with self._cond:
+            burst = self._bursts.get(key)
+            if burst is None:
+                burst = self._bursts[key] = _Burst(source, task.id, task.webhook_url, make_callback, now)
+            burst.messages.append(message)
+            burst.pushes.append(push)
+            burst.deadline = min(now + window, burst.first_at + self.max_delay)
+            self._cond.notify()
+        logger.info(f"任务 {task.id} 的{_SOURCE_NAMES[source]}推送事件已缓存，当前 {len(burst.pushes)} 个")
+
+    def _flush(self, burst):
+        count = len(burst.pushes)
+        if count == 1:
+            message = burst.messages[0]
+        else:
+            message = render_digest(burst.source, burst.pushes)
+            self.digests += 1
+            self.coalesced_events += count
+            logger.info(f"任务 {burst.task_id} 合并 {count} 个推送事件为一条汇总消息")
+        delivery_queue.send(burst.webhook_url, message, burst.make_callback(count), burst.task_id)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._stopping:
+                        due, self._bursts = list(self._bursts.values()), {}
+                        break
+                    due = [key for key, burst in self._bursts.items() if burst.deadline <= now]
+                    if due:
+                        due = [self._bursts.pop(key) for key in due]
+                        break
+                    next_deadline = min((burst.deadline for burst in self._bursts.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                stopping = self._stopping
+            for burst in due:
+                try:
+                    self._flush(burst)
+                except Exception as e:
+                    logger.error(f"发送任务 {burst.task_id} 的合并消息失败: {str(e)}")
+            if stopping:
+                return
+
+    def stats(self):
+        """合并器状态"""
+        with self._cond:
+            return {
+                'bursts': len(self._bursts),
+                'buffered_events': sum(len(burst.pushes) for burst in self._bursts.values()),
+                'digests': self.digests,
+                'coalesced_events': self.coalesced_events,
+            }
+
+event_coalescer = EventCoalescer()
+event_coalescer.start()
+atexit.register(event_coalescer.stop)
@@ -1,28 +1,161 @@
 import json
+import time
+import atexit
+import threading
 import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from utils.logger import logger
+from services.rate_limiter import webhook_rate_limiter
+from utils.config import (FEISHU_CONNECT_TIMEOUT, FEISHU_READ_TIMEOUT, FEISHU_POOL_HOSTS, FEISHU_POOL_MAXSIZE,
+                          FEISHU_RATE_LIMIT_CODES, FEISHU_RATE_LIMIT_RETRIES)
+
+class FeishuSession:
+    """飞书消息发送共享会话
+
+    所有发送共用一个带连接池的requests.Session，同一主机的连接保持keep-alive复用，
+    避免每条消息都重新进行DNS解析、TCP和TLS握手；每个请求都设置连接和读取超时，
+    不会因为某个连接无响应而一直占用调度线程。会话不保存cookie，可在多个线程间共享。
+    """
+
+    def __init__(self, pool_hosts=FEISHU_POOL_HOSTS, pool_maxsize=FEISHU_POOL_MAXSIZE,
+                 timeout=(FEISHU_CONNECT_TIMEOUT, FEISHU_READ_TIMEOUT)):
+        self.pool_hosts = pool_hosts
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapter = None
+        self.requests = 0
+        self.failures = 0
+
+    def _get_session(self):
+        session = self._session
+        if session is None:
+            with self._lock:
+                if self._session is None:
+                    adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_maxsize)
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    self._adapter, self._session = adapter, session
+                session = self._session
+        return session
+
+    def post(self, url, **kwargs):
+        """发送POST请求，未指定timeout时使用默认超时"""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            self.requests += 1
+        try:
+            return self._get_session().post(url, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+
+    def close(self):
+        """关闭会话及其全部连接"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = self._adapter = None
+
+    def stats(self):
+        """连接池状态：每个主机已创建的连接数、处理的请求数和空闲连接数"""
+        hosts = []
+        adapter = self._adapter
+        if adapter is not None:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                hosts.append({
+                    'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                    'connections_created': pool.num_connections,
+                    'requests': pool.num_requests,
+                    # 连接池队列中用None占位，非None的才是可复用的空闲连接
+                    'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                    'maxsize': self.pool_maxsize,
+                })
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'timeout': list(self.timeout),
+            'hosts': hosts,
+        }
+
+feishu_session = FeishuSession()
+atexit.register(feishu_session.close)
 
 def send_feishu_message(webhook_url, content):
     """发送飞书消息"""
     logger.info(f"发送飞书消息到: {webhook_url}")
     logger.debug(f"消息内容: {content[:50]}...")
-    
+    body = render_feishu_message(content)
+    for _ in range(FEISHU_RATE_LIMIT_RETRIES + 1):
+        # 同步发送时在当前线程等待限流
+        wait = webhook_rate_limiter.reserve(webhook_url)
+        if wait > 0:
+            time.sleep(wait)
+        success, message, rate_limited = post_feishu_request(webhook_url, body)
+        if not rate_limited:
+            break
+    return success, message
+
+def render_feishu_message(content):
+    """将消息文本渲染为飞书机器人请求体（已编码的JSON）"""
     content = content.replace("@所有人", "<at user_id='all'>所有人</at>")
-    headers = {"Content-Type": "application/json",
-                "charset": "utf-8"}
     data = {
         "msg_type": "text",
         "content": {
             "text": content
         }
     }
-    msg_encode = json.dumps(data, ensure_ascii=True).encode("utf-8")
-    
+    return json.dumps(data, ensure_ascii=True).encode("utf-8")
+
+def post_feishu_message(webhook_url, msg_encode):
+    """发送已渲染的飞书消息请求体"""
+    success, message, _ = post_feishu_request(webhook_url, msg_encode)
+    return success, message
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+def _response_code(response):
+    # 飞书机器人出错时HTTP状态码仍可能是200，错误码在响应体的code（旧版为StatusCode）中
+    try:
+        data = response.json()
+    except ValueError:
+        return None, ''
+    if not isinstance(data, dict):
+        return None, ''
+    return data.get('code', data.get('StatusCode')), data.get('msg', data.get('StatusMessage', ''))
+
+def post_feishu_request(webhook_url, msg_encode):
+    """发送已渲染的飞书消息请求体，返回 (是否成功, 结果信息, 是否被限流)
+
+    被限流时会通知限流器暂停该webhook的发送，由调用方决定是否重发。
+    """
+    headers = {"Content-Type": "application/json",
+                "charset": "utf-8"}
     try:
-        response = requests.post(webhook_url, headers=headers, data=msg_encode)
+        response = feishu_session.post(webhook_url, headers=headers, data=msg_encode)
+        code, msg = _response_code(response)
+        if response.status_code == 429 or code in FEISHU_RATE_LIMIT_CODES:
+            webhook_rate_limiter.record_rate_limited(webhook_url, _retry_after(response))
+            return False, f"消息发送失败: 飞书限流 ({code or response.status_code} {msg})", True
         response.raise_for_status()
+        if code:
+            raise ValueError(f"飞书返回错误 {code}: {msg}")
+        webhook_rate_limiter.record_success(webhook_url)
         logger.info("飞书消息发送成功")
-        return True, "消息发送成功"
+        return True, "消息发送成功", False
     except Exception as e:
         logger.error(f"飞书消息发送失败: {str(e)}")
-        return False, f"消息发送失败: {str(e)}"
+        return False, f"消息发送失败: {str(e)}", False
@@ -0,0 +1,157 @@
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from services.rate_limiter import TokenBucket
+from utils.stats import percentile
+from utils.logger import logger
+from utils.config import (LLM_MAX_CONCURRENCY, LLM_RPM, LLM_PROVIDER_CONCURRENCY, LLM_PROVIDER_RPM,
+                          LLM_QUEUE_TIMEOUT, LLM_BACKOFF, LLM_MAX_BACKOFF)
+
+def provider_host(api_url):
+    """API地址对应的服务商（主机名），用于匹配单独配置的参数"""
+    return urlparse(api_url or '').hostname or ''
+
+def is_throttled_status(status_code):
+    """429和5xx表示服务商过载，需要退避"""
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+class _ProviderState:
+    __slots__ = ('cond', 'max_in_flight', 'limit', 'successes', 'bucket', 'in_flight', 'waiters',
+                 'blocked_until', 'backoff', 'admitted', 'timed_out', 'throttled', 'waits')
+
+    def __init__(self, lock, max_in_flight, rpm):
+        self.cond = threading.Condition(lock)
+        self.max_in_flight = max_in_flight
+        # 当前允许的并发数：出现429/5xx时减半，之后每成功limit次加1，直到max_in_flight
+        self.limit = max_in_flight
+        self.successes = 0
+        self.bucket = TokenBucket(rpm, 60) if rpm > 0 else None
+        self.in_flight = 0
+        self.waiters = deque()
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.admitted = 0
+        self.timed_out = 0
+        self.throttled = 0
+        self.waits = deque(maxlen=500)
+
+class LLMLimiter:
+    """按API地址控制大模型请求的并发数和频率
+
+    每个API地址同时最多max_in_flight个请求、每分钟最多rpm个请求，超出时按到达顺序排队，
+    排队超过timeout秒的调用直接失败，不会无限占用调度线程。收到429或5xx响应后该地址暂停请求一段时间，
+    连续出现时暂停时间翻倍，同时并发数减半，之后随成功的请求逐步恢复。
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_CONCURRENCY, rpm=LLM_RPM, timeout=LLM_QUEUE_TIMEOUT,
+                 backoff=LLM_BACKOFF, max_backoff=LLM_MAX_BACKOFF):
+        self.max_in_flight = max_in_flight
+        self.rpm = rpm
+        self.timeout = timeout
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._providers = {}
+
+    def _state(self, api_url):
+        state = self._providers.get(api_url)
+        if state is None:
+            host = provider_host(api_url)
+            state = self._providers[api_url] = _ProviderState(
+                self._lock,
+                LLM_PROVIDER_CONCURRENCY.get(host, self.max_in_flight),
+                LLM_PROVIDER_RPM.get(host, self.rpm),
+            )
+        return state
+
+    def _admit_wait(self, state, now):
+        # 队首请求还需等待的秒数，None表示需要等其他请求结束
+        if state.max_in_flight > 0 and state.in_flight >= state.limit:
+            return None
+        wait = state.blocked_until - now
+        if state.bucket is not None:
+            wait = max(wait, state.bucket.available_in(now))
+        return max(0.0, wait)
+
+    def acquire(self, api_url, timeout=None):
+        """排队等待调用许可，返回是否获得许可；获得许可后必须调用release"""
+        timeout = self.timeout if timeout is None else timeout
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + max(0.0, timeout)
+        with self._lock:
+            state = self._state(api_url)
+            state.waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._admit_wait(state, now) if state.waiters[0] is ticket else None
+                    if wait == 0:
+                        state.waiters.popleft()
+                        state.in_flight += 1
+                        state.admitted += 1
+                        if state.bucket is not None:
+                            state.bucket.reserve(now)
+                        state.waits.append(now - start)
+                        # 队首已变化，让下一个请求检查能否调用
+                        state.cond.notify_all()
+                        return True
+                    if now >= deadline:
+                        state.timed_out += 1
+                        return False
+                    state.cond.wait(deadline - now if wait is None else min(wait, deadline - now))
+            finally:
+                if ticket in state.waiters:
+                    state.waiters.remove(ticket)
+                    state.cond.notify_all()
+
+    def release(self, api_url, success=True, status_code=None, retry_after=None):
+        """调用结束，status_code为失败时的HTTP状态码，429和5xx时暂停该地址的请求"""
+        pause = None
+        with self._lock:
+            state = self._state(api_url)
+            state.in_flight -= 1
+            if is_throttled_status(status_code):
+                state.throttled += 1
+                state.backoff = min(self.max_backoff, state.backoff * 2 if state.backoff else self.initial_backoff)
+                pause = max(state.backoff, retry_after or 0.0)
+                state.blocked_until = max(state.blocked_until, time.monotonic() + pause)
+                state.limit = limit = max(1, state.limit // 2)
+                state.successes = 0
+            elif success:
+                state.backoff = 0.0
+                if state.limit < state.max_in_flight:
+                    state.successes += 1
+                    if state.successes >= state.limit:
+                        state.limit += 1
+                        state.successes = 0
+            state.cond.notify_all()
+        if pause is not None:
+            logger.warning(f"大模型API {api_url} 返回 {status_code}，暂停请求 {pause:.1f} 秒，并发数降为 {limit}")
+
+    def stats(self):
+        """各API地址的排队和限流统计，等待时间单位为秒"""
+        now = time.monotonic()
+        with self._lock:
+            providers = []
+            for api_url, state in self._providers.items():
+                waits = sorted(state.waits)
+                providers.append({
+                    'api_url': api_url,
+                    'max_in_flight': state.max_in_flight,
+                    'limit': state.limit,
+                    'rpm': int(state.bucket.capacity) if state.bucket is not None else 0,
+                    'in_flight': state.in_flight,
+                    'queued': len(state.waiters),
+                    'admitted': state.admitted,
+                    'timed_out': state.timed_out,
+                    'throttled': state.throttled,
+                    'backoff': state.backoff,
+                    'paused_for': round(max(0.0, state.blocked_until - now), 3),
+                    'wait_p50': round(percentile(waits, 50), 3),
+                    'wait_p95': round(percentile(waits, 95), 3),
+                })
+            return {'timeout': self.timeout, 'providers': providers}
+
+llm_limiter = LLMLimiter()
@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+from utils.stats import percentile
+from utils.config import LLM_METRICS_SAMPLES
+
+def _seconds(values, p):
+    return round(percentile(values, p), 3) if values else None
+
+class _ModelSamples:
+    __slots__ = ('calls', 'failures', 'truncated', 'hedged', 'failovers', 'ttft', 'total', 'tokens_per_second')
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.failures = 0
+        self.truncated = 0
+        # 因该模型耗时过长发起对冲请求、因该模型失败切换到下一个候选的次数
+        self.hedged = 0
+        self.failovers = 0
+        self.ttft = deque(maxlen=samples)
+        self.total = deque(maxlen=samples)
+        self.tokens_per_second = deque(maxlen=samples)
+
+class LLMMetrics:
+    """按模型统计大模型调用耗时
+
+    每个模型保留最近samples次调用的首个token耗时（仅流式生成）、总耗时和输出速度（token/秒），
+    输出速度按首个token之后的生成时间计算，没有返回token用量时按收到的内容片段数估算。
+    """
+
+    def __init__(self, samples=LLM_METRICS_SAMPLES):
+        self.samples = max(1, samples)
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _model(self, model_name):
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = _ModelSamples(self.samples)
+        return model
+
+    def record(self, model_name, success, total, ttft=None, tokens=None, truncated=False):
+        """记录一次调用，耗时单位为秒"""
+        with self._lock:
+            model = self._model(model_name)
+            model.calls += 1
+            if not success:
+                model.failures += 1
+                return
+            if truncated:
+                model.truncated += 1
+            model.total.append(total)
+            if ttft is not None:
+                model.ttft.append(ttft)
+            generation = total - (ttft or 0)
+            if tokens and generation > 0:
+                model.tokens_per_second.append(tokens / generation)
+
+    def record_hedged(self, model_name):
+        with self._lock:
+            self._model(model_name).hedged += 1
+
+    def record_failover(self, model_name):
+        with self._lock:
+            self._model(model_name).failovers += 1
+
+    def total_p95(self, model_name, min_samples=1):
+        """该模型成功调用总耗时的p95（秒），样本不足min_samples时返回None"""
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None or len(model.total) < max(1, min_samples):
+                return None
+            return percentile(sorted(model.total), 95)
+
+    def stats(self):
+        """各模型的调用次数以及耗时（秒）和输出速度的p50/p95"""
+        with self._lock:
+            result = {}
+            for model_name, model in self._models.items():
+                ttft, total, speed = sorted(model.ttft), sorted(model.total), sorted(model.tokens_per_second)
+                result[model_name] = {
+                    'calls': model.calls,
+                    'failures': model.failures,
+                    'truncated': model.truncated,
+                    'hedged': model.hedged,
+                    'failovers': model.failovers,
+                    'ttft_p50': _seconds(ttft, 50),
+                    'ttft_p95': _seconds(ttft, 95),
+                    'total_p50': _seconds(total, 50),
+                    'total_p95': _seconds(total, 95),
+                    'tokens_per_second_p50': round(percentile(speed, 50), 1) if speed else None,
+                }
+            return result
+
+llm_metrics = LLMMetrics()
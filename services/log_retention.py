@@ -0,0 +1,148 @@
+import os
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+from models.db import execute_query, transaction, get_db_connection
+from services.run_metrics import purge_task_runs
+from services.outbox import outbox
+from utils.logger import logger
+from utils.config import (LOG_RETENTION_DAYS, LOG_RETENTION_MAX_ROWS, LOG_RETENTION_BATCH_SIZE,
+                          LOG_ARCHIVE_DIR, LOG_VACUUM_PAGES)
+
+# 同一时间只允许一个清理或VACUUM在运行
+_maintenance_lock = threading.Lock()
+
+def _age_cutoff(days):
+    """按保留天数计算的截止时间，早于该时间的日志会被清理"""
+    if not days or days <= 0:
+        return None
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _row_cutoff(max_rows):
+    """按最大行数计算的截止位置 (created_at, id)，该位置及更早的日志会被清理"""
+    if not max_rows or max_rows <= 0:
+        return None
+    return execute_query(
+        "SELECT created_at, id FROM logs ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+        (max_rows,),
+        fetch_one=True
+    )
+
+def _archive_rows(rows, archive_dir):
+    """按日期把日志追加到压缩的NDJSON文件中（每天一个文件）"""
+    by_day = {}
+    for row in rows:
+        log_id, task_id, status, message, created_at = row
+        day = (created_at or '')[:10] or 'unknown'
+        by_day.setdefault(day, []).append({
+            'id': log_id,
+            'task_id': task_id,
+            'status': status,
+            'message': message,
+            'created_at': created_at
+        })
+
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, items in by_day.items():
+        path = os.path.join(archive_dir, f"logs-{day}.ndjson.gz")
+        # 追加模式会写入新的gzip成员，读取时会被当作同一个文件连续解压
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False))
+                f.write('\n')
+
+def _delete_batches(condition, params, batch_size, archive_dir):
+    """按created_at从旧到新分批归档并删除满足条件的日志，返回删除条数"""
+    deleted = 0
+    while True:
+        rows = execute_query(
+            f"SELECT id, task_id, status, message, created_at FROM logs WHERE {condition} "
+            "ORDER BY created_at, id LIMIT ?",
+            tuple(params) + (batch_size,)
+        )
+        if not rows:
+            break
+        if archive_dir:
+            _archive_rows(rows, archive_dir)
+        ids = [row[0] for row in rows]
+        with transaction() as conn:
+            conn.execute(f"DELETE FROM logs WHERE id IN ({','.join('?' * len(ids))})", ids)
+        deleted += len(ids)
+        if len(rows) < batch_size:
+            break
+    return deleted
+
+def incremental_vacuum(pages=LOG_VACUUM_PAGES):
+    """回收空闲页，仅在auto_vacuum为INCREMENTAL（迁移v11启用）时生效"""
+    with get_db_connection() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            logger.debug("数据库未启用增量VACUUM，跳过")
+            return False
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return True
+
+def enable_incremental_vacuum():
+    """auto_vacuum尚未生效时执行一次整库VACUUM切换为增量模式，返回是否执行了VACUUM
+
+    迁移v11只设置了模式，已有数据库需VACUUM后才会生效。由日志清理任务调用，
+    失败时（例如其他进程正在写入）下次清理再试。
+    """
+    with get_db_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        logger.info("执行一次数据库VACUUM以启用增量auto_vacuum，期间会阻塞写入")
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        except Exception as e:
+            logger.warning(f"启用增量auto_vacuum失败，下次清理时重试: {str(e)}")
+            return False
+    logger.info("已启用增量auto_vacuum")
+    return True
+
+def vacuum():
+    """整库VACUUM，重建数据库文件整理碎片；执行期间会阻塞所有写入，默认不定期执行"""
+    with _maintenance_lock:
+        logger.info("开始执行数据库VACUUM")
+        with get_db_connection() as conn:
+            conn.execute("VACUUM")
+        logger.info("数据库VACUUM完成")
+
+def run_retention(days=LOG_RETENTION_DAYS, max_rows=LOG_RETENTION_MAX_ROWS,
+                  batch_size=LOG_RETENTION_BATCH_SIZE, archive_dir=LOG_ARCHIVE_DIR):
+    """按保留天数和最大行数清理日志，并清理过期的执行耗时记录和outbox消息，返回清理统计"""
+    if not _maintenance_lock.acquire(blocking=False):
+        logger.info("日志清理正在进行中，跳过本次执行")
+        return {'deleted': 0, 'skipped': True}
+    try:
+        deleted = 0
+        cutoff = _age_cutoff(days)
+        if cutoff:
+            deleted += _delete_batches("created_at < ?", (cutoff,), batch_size, archive_dir)
+
+        position = _row_cutoff(max_rows)
+        if position:
+            deleted += _delete_batches("(created_at, id) <= (?, ?)", position, batch_size, archive_dir)
+
+        # 执行耗时记录和已发送/死信消息只按保留天数清理，不归档
+        deleted += purge_task_runs(batch_size=batch_size)
+        deleted += outbox.purge(batch_size=batch_size)
+
+        # 整库VACUUM同时回收了空闲页，不需要再增量回收
+        vacuumed = enable_incremental_vacuum()
+        if deleted:
+            if not vacuumed:
+                incremental_vacuum()
+            logger.info(f"日志清理完成，共清理 {deleted} 条日志")
+        return {'deleted': deleted, 'skipped': False}
+    finally:
+        _maintenance_lock.release()
+
+def purge_all_logs(batch_size=LOG_RETENTION_BATCH_SIZE):
+    """分批删除全部日志（不归档），避免一次性大事务长时间锁库"""
+    with _maintenance_lock:
+        deleted = _delete_batches("1 = 1", (), batch_size, None)
+    incremental_vacuum()
+    return deleted
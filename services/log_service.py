@@ -1,18 +1,85 @@
+import json
+import base64
+from datetime import datetime
 from models.db import execute_query
+from services.log_writer import log_writer
+from services.log_retention import purge_all_logs
 
-def get_logs():
-    """获取日志列表"""
-    # 按时间倒序获取最近100条日志
-    return execute_query("SELECT l.*, t.name FROM logs l LEFT JOIN tasks t ON l.task_id = t.id ORDER BY l.created_at DESC LIMIT 100")
+DEFAULT_LOG_PAGE_SIZE = 100
+MAX_LOG_PAGE_SIZE = 500
+
+def encode_log_cursor(created_at, log_id):
+    """将分页位置编码为不透明的游标字符串"""
+    raw = json.dumps([created_at, log_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_log_cursor(cursor):
+    """解析游标，格式错误时抛出ValueError"""
+    try:
+        created_at, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(created_at), int(log_id)
+    except Exception:
+        raise ValueError(f"无效的游标: {cursor}")
+
+def _normalize_time(value):
+    """将时间参数统一为数据库中的 YYYY-MM-DD HH:MM:SS 格式"""
+    try:
+        return datetime.fromisoformat(value.strip()).strftime('%Y-%m-%d %H:%M:%S')
+    except (AttributeError, ValueError):
+        raise ValueError(f"无效的时间格式: {value}")
+
+def get_logs(limit=DEFAULT_LOG_PAGE_SIZE, cursor=None, task_id=None, status=None, start_time=None, end_time=None):
+    """按时间倒序分页获取日志
+
+    使用 (created_at, id) 作为游标做键集分页，翻到任意深度的代价都与第一页相同。
+    返回 (日志列表, 下一页游标)，没有更多数据时游标为None。
+    """
+    limit = max(1, min(int(limit), MAX_LOG_PAGE_SIZE))
+    conditions = []
+    params = []
+    if task_id is not None:
+        conditions.append("l.task_id = ?")
+        params.append(int(task_id))
+    if status:
+        conditions.append("l.status = ?")
+        params.append(status)
+    if start_time:
+        conditions.append("l.created_at >= ?")
+        params.append(_normalize_time(start_time))
+    if end_time:
+        conditions.append("l.created_at <= ?")
+        params.append(_normalize_time(end_time))
+    if cursor:
+        conditions.append("(l.created_at, l.id) < (?, ?)")
+        params.extend(decode_log_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    # 多取一条用于判断是否还有下一页
+    params.append(limit + 1)
+    logs = execute_query(
+        "SELECT l.id, l.task_id, l.status, l.message, l.created_at, t.name FROM logs l "
+        "LEFT JOIN tasks t ON l.task_id = t.id "
+        f"{where}ORDER BY l.created_at DESC, l.id DESC LIMIT ?",
+        tuple(params)
+    )
+
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        last = logs[-1]
+        next_cursor = encode_log_cursor(last[4], last[0])
+    return logs, next_cursor
 
 def clear_logs():
     """清空日志"""
-    execute_query("DELETE FROM logs", commit=True)
+    # 先落盘缓冲中的日志，避免清空后又被写入
+    log_writer.flush()
+    return purge_all_logs()
 
 def add_log(task_id, status, message):
-    """添加日志"""
-    execute_query(
-        "INSERT INTO logs (task_id, status, message) VALUES (?, ?, ?)",
-        (task_id, status, message),
-        commit=True
-    )
+    """添加日志（异步批量写入，不阻塞调用方）"""
+    log_writer.write(task_id, status, message)
+
+def flush_logs(timeout=None):
+    """立即落盘缓冲中的日志"""
+    return log_writer.flush(timeout)
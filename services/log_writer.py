@@ -0,0 +1,191 @@
+import queue
+import atexit
+import threading
+import time
+from datetime import datetime
+from models.db import transaction
+from utils.logger import logger
+from utils.config import LOG_WRITER_BATCH_SIZE, LOG_WRITER_FLUSH_INTERVAL
+
+class _FlushRequest:
+    """写入线程收到后立即落盘当前批次，并通知等待方"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+_STOP = object()
+
+# 保留失败批次重试时，两次重试之间的最长间隔（秒）；退出前最多再尝试的次数
+_MAX_RETRY_DELAY = 5.0
+_STOP_RETRIES = 3
+# 保留重试的记录最多为batch_size的多少倍，超出时丢弃最早的记录，避免数据库长时间不可写时内存无限增长
+_MAX_RETAINED_BATCHES = 50
+
+class BatchWriter:
+    """后台批量写入器
+
+    记录先进入内存队列，由后台线程按批次写入数据库：攒够batch_size条
+    或距首条记录超过flush_interval秒时，在一个事务中用insert_sql提交整批记录。
+    调用方只负责入队，不会等待SQLite提交。写入失败的批次默认丢弃；retry_failed为True时
+    （例如outbox）保留失败批次，按退避间隔与之后的记录一起按原顺序重试，不会因为数据库短暂锁定丢记录；
+    保留的记录超过batch_size的_MAX_RETAINED_BATCHES倍时丢弃最早的记录。
+    """
+
+    def __init__(self, insert_sql, name, batch_size=LOG_WRITER_BATCH_SIZE, flush_interval=LOG_WRITER_FLUSH_INTERVAL,
+                 retry_failed=False):
+        self.insert_sql = insert_sql
+        self.retry_failed = retry_failed
+        self.name = name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.01, flush_interval)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True)
+            self._thread.start()
+        logger.info(f"*** {self.name}写入线程已启动")
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, row):
+        """记录入队，立即返回"""
+        self._queue.put(tuple(row))
+        if not self.is_running():
+            # 写入线程未运行（例如已停止），直接同步落盘，避免丢记录
+            self.flush()
+
+    def flush(self, timeout=None):
+        """将队列中的记录全部落盘，返回是否在超时前完成"""
+        if not self.is_running():
+            self._write_batch(self._drain())
+            return True
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout)
+
+    def stop(self, timeout=5):
+        """停止写入线程，退出前落盘剩余记录"""
+        if not self.is_running():
+            self._write_batch(self._drain())
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info(f"{self.name}写入线程已停止")
+
+    def stats(self):
+        """写入器状态"""
+        return {
+            'running': self.is_running(),
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'failed': self.failed,
+            'retries': self.retries,
+        }
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                rows.append(item)
+            elif isinstance(item, _FlushRequest):
+                item.done.set()
+        return rows
+
+    def _run(self):
+        batch = []
+        deadline = None
+        retry_delay = 0.0
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                # 等待重试期间只积攒记录，到重试时间再一起写入
+                if len(batch) < self.batch_size or retry_delay:
+                    continue
+            elif item is _STOP:
+                batch.extend(self._drain())
+                for attempt in range(_STOP_RETRIES if self.retry_failed else 1):
+                    if attempt:
+                        time.sleep(min(_MAX_RETRY_DELAY, self.flush_interval * 2 ** attempt))
+                    if self._write_batch(batch, keep=attempt < _STOP_RETRIES - 1 and self.retry_failed):
+                        break
+                return
+
+            if self._write_batch(batch, keep=self.retry_failed):
+                batch = []
+                deadline = None
+                retry_delay = 0.0
+            else:
+                self._trim_retained(batch)
+                retry_delay = min(_MAX_RETRY_DELAY, retry_delay * 2 if retry_delay else self.flush_interval)
+                deadline = time.monotonic() + retry_delay
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+
+    def _trim_retained(self, batch):
+        overflow = len(batch) - self.batch_size * _MAX_RETAINED_BATCHES
+        if overflow > 0:
+            del batch[:overflow]
+            self.failed += overflow
+            logger.error(f"{self.name}待重试记录过多，丢弃最早的 {overflow} 条")
+
+    def _write_batch(self, batch, keep=False):
+        # 返回是否写入成功；keep为True时失败的批次由调用方保留重试
+        if not batch:
+            return True
+        try:
+            with transaction() as conn:
+                conn.executemany(self.insert_sql, batch)
+            self.written += len(batch)
+            logger.debug(f"{self.name}批量写入 {len(batch)} 条")
+            return True
+        except Exception as e:
+            if keep:
+                self.retries += 1
+                logger.warning(f"{self.name}批量写入失败，{len(batch)} 条稍后重试: {str(e)}")
+            else:
+                self.failed += len(batch)
+                logger.error(f"{self.name}批量写入失败，丢弃 {len(batch)} 条: {str(e)}")
+            return False
+
+class LogWriter(BatchWriter):
+    """执行日志后台写入器
+
+    调度线程、Webhook请求写日志时只入队，由后台线程批量写入logs表。
+    """
+
+    def __init__(self, batch_size=LOG_WRITER_BATCH_SIZE, flush_interval=LOG_WRITER_FLUSH_INTERVAL):
+        super().__init__(
+            "INSERT INTO logs (task_id, status, message, created_at) VALUES (?, ?, ?, ?)",
+            '日志', batch_size, flush_interval
+        )
+
+    def write(self, task_id, status, message):
+        """日志入队，立即返回；created_at取入队时间"""
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.put((task_id, status, message, created_at))
+
+log_writer = LogWriter()
+log_writer.start()
+atexit.register(log_writer.stop)
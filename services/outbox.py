@@ -0,0 +1,170 @@
+import time
+import uuid
+import random
+from models.db import execute_query, transaction
+from services.log_writer import BatchWriter
+from utils.logger import logger
+from utils.config import (CLUSTER_NODE_ID, LOG_WRITER_BATCH_SIZE, OUTBOX_FLUSH_INTERVAL, OUTBOX_BACKOFF_BASE,
+                          OUTBOX_BACKOFF_MAX, OUTBOX_RETENTION_DAYS)
+
+# 进程启动时间：启动时只接管本节点ID名下在此之前创建的消息，本进程已入队的消息不会被重复接管
+_STARTED_AT = time.time()
+
+# 消息状态：待发送（含等待重试）、已发送、死信（超过最大发送次数）
+PENDING, SENT, DEAD = 'pending', 'sent', 'dead'
+
+_OUTBOX_COLUMNS = ('id', 'task_id', 'webhook_url', 'body', 'status', 'attempts', 'next_attempt_at',
+                   'last_error', 'owner', 'created_at', 'updated_at')
+
+# 新消息和状态变化都以同一条upsert语句按顺序批量写入，发送成功时即使插入尚未落盘也能正确合并
+_UPSERT_OUTBOX_SQL = (
+    f"INSERT INTO outbox ({', '.join(_OUTBOX_COLUMNS)}) VALUES ({', '.join('?' * len(_OUTBOX_COLUMNS))}) "
+    "ON CONFLICT(id) DO UPDATE SET status = excluded.status, attempts = excluded.attempts, "
+    "next_attempt_at = excluded.next_attempt_at, last_error = excluded.last_error, "
+    "owner = excluded.owner, updated_at = excluded.updated_at"
+)
+
+class OutboxMessage:
+    """一条待发送的飞书消息"""
+
+    __slots__ = ('id', 'task_id', 'webhook_url', 'body', 'status', 'attempts', 'next_attempt_at',
+                 'last_error', 'created_at', 'callback', 'enqueued_at', 'reserved')
+
+    def __init__(self, webhook_url, body, task_id=None, callback=None, id=None, attempts=0,
+                 created_at=None, next_attempt_at=None, last_error=None):
+        self.id = id or uuid.uuid4().hex
+        self.task_id = task_id
+        self.webhook_url = webhook_url
+        self.body = body
+        self.status = PENDING
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+        self.last_error = last_error
+        self.created_at = created_at or time.time()
+        self.callback = callback
+        self.enqueued_at = time.monotonic()
+        # 是否已在限流器中预约过发送时间
+        self.reserved = False
+
+    def row(self):
+        return (self.id, self.task_id, self.webhook_url, self.body, self.status, self.attempts,
+                self.next_attempt_at, self.last_error, CLUSTER_NODE_ID, self.created_at, time.time())
+
+def backoff_delay(attempts, base=OUTBOX_BACKOFF_BASE, maximum=OUTBOX_BACKOFF_MAX):
+    """第attempts次发送失败后的重试等待秒数：指数退避，并在 [50%, 100%] 区间内随机抖动，避免集中重试"""
+    delay = min(maximum, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+class Outbox:
+    """持久化的待发送消息表
+
+    消息入队时写入一行pending记录，发送成功后改为sent，失败后记录错误和下次发送时间，
+    超过最大发送次数后改为dead（死信）。写入由后台线程批量提交，不阻塞发送路径；
+    进程重启后从表中恢复未发送的消息。消息至少发送一次：发送成功但状态尚未落盘时崩溃，重启后会重发。
+    """
+
+    def __init__(self, flush_interval=OUTBOX_FLUSH_INTERVAL):
+        # 写入失败（例如数据库被锁定）时保留批次重试，不丢弃消息状态
+        self.writer = BatchWriter(_UPSERT_OUTBOX_SQL, '待发送消息', LOG_WRITER_BATCH_SIZE, flush_interval,
+                                  retry_failed=True)
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self, timeout=5):
+        self.writer.stop(timeout)
+
+    def save(self, message):
+        """记录消息当前状态（异步批量写入）"""
+        self.writer.put(message.row())
+
+    def claim_pending(self, include_own=False):
+        """接管待发送的消息，返回OutboxMessage列表
+
+        只接管所属节点已不在集群节点表中的消息；include_own为True时（启动时）同时接管本节点ID名下、
+        进程启动前创建的消息。调度器在导入时已启动，恢复前触发的任务发出的消息已在本进程的队列中，不能再次接管。
+        """
+        self.writer.flush()
+        claim = f"{CLUSTER_NODE_ID}#{uuid.uuid4().hex}"
+        owner_condition = "owner IS NULL OR owner NOT IN (SELECT node_id FROM cluster_nodes WHERE node_id != ?)"
+        params = (claim, CLUSTER_NODE_ID)
+        if include_own:
+            owner_condition = f"({owner_condition}) AND NOT (owner = ? AND created_at >= ?)"
+            params = (claim, CLUSTER_NODE_ID, CLUSTER_NODE_ID, _STARTED_AT)
+        else:
+            owner_condition = f"owner != ? AND ({owner_condition})"
+            params = (claim, CLUSTER_NODE_ID, CLUSTER_NODE_ID)
+        with transaction() as conn:
+            # 先用唯一的认领标记更新，再按标记读取，多个节点同时恢复时每条消息只会被一个节点接管
+            conn.execute(f"UPDATE outbox SET owner = ? WHERE status = '{PENDING}' AND ({owner_condition})", params)
+            rows = conn.execute(
+                "SELECT id, task_id, webhook_url, body, attempts, next_attempt_at, last_error, created_at "
+                "FROM outbox WHERE owner = ? ORDER BY created_at",
+                (claim,)
+            ).fetchall()
+            conn.execute("UPDATE outbox SET owner = ? WHERE owner = ?", (CLUSTER_NODE_ID, claim))
+        messages = []
+        for message_id, task_id, webhook_url, body, attempts, next_attempt_at, last_error, created_at in rows:
+            messages.append(OutboxMessage(
+                webhook_url, body, task_id=task_id, id=message_id, attempts=attempts,
+                created_at=created_at, next_attempt_at=next_attempt_at, last_error=last_error
+            ))
+        if messages:
+            logger.info(f"*** 从outbox恢复 {len(messages)} 条未发送的消息")
+        return messages
+
+    def dead_letters(self, limit=100):
+        """最近的死信消息"""
+        self.writer.flush()
+        rows = execute_query(
+            "SELECT id, task_id, attempts, last_error, created_at, updated_at FROM outbox "
+            f"WHERE status = '{DEAD}' ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        )
+        return [dict(zip(('id', 'task_id', 'attempts', 'last_error', 'created_at', 'updated_at'), row)) for row in rows]
+
+    def revive(self, message_id):
+        """将死信消息重新置为待发送，返回OutboxMessage，消息不存在或不是死信时返回None"""
+        self.writer.flush()
+        with transaction() as conn:
+            row = conn.execute(
+                "SELECT task_id, webhook_url, body, created_at FROM outbox WHERE id = ? AND status = ?",
+                (message_id, DEAD)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = NULL, owner = ?, updated_at = ? WHERE id = ?",
+                (PENDING, CLUSTER_NODE_ID, time.time(), message_id)
+            )
+        task_id, webhook_url, body, created_at = row
+        return OutboxMessage(webhook_url, body, task_id=task_id, id=message_id, created_at=created_at)
+
+    def counts(self):
+        """各状态的消息数"""
+        self.writer.flush()
+        rows = execute_query("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        return {status: count for status, count in rows}
+
+    def purge(self, days=OUTBOX_RETENTION_DAYS, batch_size=1000):
+        """分批删除超过保留天数的已发送和死信消息，返回删除条数"""
+        if not days or days <= 0:
+            return 0
+        cutoff = time.time() - days * 86400
+        deleted = 0
+        while True:
+            with transaction() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox "
+                    "WHERE status IN (?, ?) AND updated_at < ? LIMIT ?)",
+                    (SENT, DEAD, cutoff, batch_size)
+                )
+                count = cursor.rowcount
+            deleted += count
+            if count < batch_size:
+                break
+        if deleted:
+            logger.info(f"已清理 {deleted} 条已发送或死信消息")
+        return deleted
+
+outbox = Outbox()
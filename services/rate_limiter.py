@@ -0,0 +1,120 @@
+import time
+import threading
+from utils.logger import logger
+from utils.config import FEISHU_RATE_LIMITS, FEISHU_RATE_LIMIT_BACKOFF, FEISHU_RATE_LIMIT_MAX_BACKOFF
+
+class TokenBucket:
+    """令牌桶：period秒内最多capacity次，令牌可预支，预支后返回需要等待的秒数"""
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def available_in(self, now):
+        """不预支令牌，返回还需等待多少秒才有可用令牌"""
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+def mask_webhook(webhook_url):
+    """隐藏webhook地址中的token，只保留末尾4位用于区分"""
+    url = webhook_url or ''
+    head, sep, token = url.rpartition('/')
+    if not sep or len(token) <= 4:
+        return url
+    return f"{head}/****{token[-4:]}"
+
+class _WebhookState:
+    __slots__ = ('buckets', 'blocked_until', 'backoff', 'sent', 'throttled', 'throttle_wait', 'rate_limited')
+
+    def __init__(self, limits):
+        self.buckets = [TokenBucket(capacity, period) for capacity, period in limits]
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.sent = 0
+        self.throttled = 0
+        self.throttle_wait = 0.0
+        self.rate_limited = 0
+
+class WebhookRateLimiter:
+    """按飞书webhook地址分别限流
+
+    每个webhook使用一组令牌桶（例如每秒5条、每分钟100条），发送前预约发送时间，
+    超出频率的消息延后到可发送的时间而不是直接失败。收到飞书的限流响应后，
+    该webhook暂停发送一段时间，连续被限流时暂停时间翻倍，发送成功后恢复。
+    """
+
+    def __init__(self, limits=FEISHU_RATE_LIMITS, backoff=FEISHU_RATE_LIMIT_BACKOFF,
+                 max_backoff=FEISHU_RATE_LIMIT_MAX_BACKOFF):
+        self.limits = tuple(limits)
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._webhooks = {}
+
+    def _state(self, webhook_url):
+        state = self._webhooks.get(webhook_url)
+        if state is None:
+            state = self._webhooks[webhook_url] = _WebhookState(self.limits)
+        return state
+
+    def reserve(self, webhook_url):
+        """预约一次发送，返回需要等待的秒数，0表示可以立即发送"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(webhook_url)
+            wait = max([bucket.reserve(now) for bucket in state.buckets] + [state.blocked_until - now, 0.0])
+            if wait > 0:
+                state.throttled += 1
+                state.throttle_wait += wait
+            return wait
+
+    def paused_for(self, webhook_url):
+        """该webhook因被飞书限流还需暂停的秒数"""
+        with self._lock:
+            state = self._webhooks.get(webhook_url)
+            return max(0.0, state.blocked_until - time.monotonic()) if state else 0.0
+
+    def record_success(self, webhook_url):
+        """发送成功，清除该webhook的退避状态"""
+        with self._lock:
+            state = self._state(webhook_url)
+            state.sent += 1
+            state.backoff = 0.0
+
+    def record_rate_limited(self, webhook_url, retry_after=None):
+        """收到飞书限流响应，暂停该webhook的发送，返回暂停秒数"""
+        with self._lock:
+            state = self._state(webhook_url)
+            state.rate_limited += 1
+            state.backoff = min(self.max_backoff, state.backoff * 2 if state.backoff else self.initial_backoff)
+            pause = max(state.backoff, retry_after or 0.0)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + pause)
+        logger.warning(f"飞书webhook {mask_webhook(webhook_url)} 被限流，暂停发送 {pause:.1f} 秒")
+        return pause
+
+    def stats(self):
+        """各webhook的限流统计，webhook地址已隐藏token"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'limits': [{'count': capacity, 'period': period} for capacity, period in self.limits],
+                'webhooks': [{
+                    'webhook': mask_webhook(webhook_url),
+                    'sent': state.sent,
+                    'throttled': state.throttled,
+                    'throttle_wait': round(state.throttle_wait, 3),
+                    'rate_limited': state.rate_limited,
+                    'backoff': state.backoff,
+                    'paused_for': round(max(0.0, state.blocked_until - now), 3),
+                } for webhook_url, state in self._webhooks.items()],
+            }
+
+webhook_rate_limiter = WebhookRateLimiter()
@@ -0,0 +1,133 @@
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from models.db import execute_query, transaction
+from services.log_writer import BatchWriter
+from utils.stats import percentile
+from utils.logger import logger
+from utils.config import RUN_METRICS_RETENTION_DAYS, RUN_METRICS_WINDOW_HOURS
+
+# 每次执行记录的阶段：调度延迟、内容生成（拉取新闻/调用大模型）、消息渲染、发送以及总耗时
+METRIC_PHASES = ('lag', 'generate', 'render', 'send', 'total')
+
+_INSERT_RUN_SQL = (
+    "INSERT INTO task_runs (task_id, status, scheduled_at, started_at, lag_ms, generate_ms, render_ms, send_ms, total_ms) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+run_metrics_writer = BatchWriter(_INSERT_RUN_SQL, '执行耗时')
+run_metrics_writer.start()
+atexit.register(run_metrics_writer.stop)
+
+# 调度线程池在执行任务前写入本次触发的计划时间，手动执行时为空
+_run_context = threading.local()
+
+def set_scheduled_time(timestamp):
+    """设置当前线程正在执行的触发的计划时间（Unix时间戳），None表示清除"""
+    _run_context.scheduled_at = timestamp
+
+def get_scheduled_time():
+    """当前线程正在执行的触发的计划时间，不是由调度器触发时返回None"""
+    return getattr(_run_context, 'scheduled_at', None)
+
+def _ms(seconds):
+    return None if seconds is None else int(round(seconds * 1000))
+
+class RunTimer:
+    """单次任务执行的分阶段计时"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.scheduled_at = get_scheduled_time()
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.durations = {}
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时，同一阶段多次进入时累加"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.monotonic() - start
+
+    def add(self, name, seconds):
+        """记录在其他线程中统计的阶段耗时（例如异步发送）"""
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def record(self, status):
+        """记录本次执行结果和各阶段耗时（异步批量写入）"""
+        lag = None
+        if self.scheduled_at is not None:
+            lag = max(0.0, self.started_at - self.scheduled_at)
+        run_metrics_writer.put((
+            self.task_id, status, self.scheduled_at, self.started_at, _ms(lag),
+            _ms(self.durations.get('generate')), _ms(self.durations.get('render')),
+            _ms(self.durations.get('send')), _ms(time.monotonic() - self._start)
+        ))
+
+def _summarize(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+def get_run_metrics(task_id=None, hours=RUN_METRICS_WINDOW_HOURS):
+    """统计最近hours小时内各阶段耗时的p50/p95/p99（毫秒），按任务分组并给出整体统计"""
+    run_metrics_writer.flush()
+    since = time.time() - hours * 3600
+    query = ("SELECT task_id, status, lag_ms, generate_ms, render_ms, send_ms, total_ms "
+             "FROM task_runs WHERE started_at >= ?")
+    params = [since]
+    if task_id is not None:
+        query += " AND task_id = ?"
+        params.append(task_id)
+    rows = execute_query(query, tuple(params))
+
+    by_task = {}
+    for row in rows:
+        by_task.setdefault(row[0], []).append(row)
+
+    def summarize(rows):
+        return {
+            'runs': len(rows),
+            'failures': sum(1 for row in rows if row[1] != '成功'),
+            'phases': {phase: _summarize(row[2 + index] for row in rows)
+                       for index, phase in enumerate(METRIC_PHASES)},
+        }
+
+    tasks = []
+    for current_id in sorted(by_task):
+        summary = summarize(by_task[current_id])
+        summary['task_id'] = current_id
+        tasks.append(summary)
+    return {'hours': hours, 'overall': summarize(rows), 'tasks': tasks}
+
+def purge_task_runs(days=RUN_METRICS_RETENTION_DAYS, batch_size=1000):
+    """分批删除超过保留天数的执行耗时记录，返回删除条数"""
+    if not days or days <= 0:
+        return 0
+    cutoff = time.time() - days * 86400
+    deleted = 0
+    while True:
+        with transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM task_runs WHERE id IN "
+                "(SELECT id FROM task_runs WHERE started_at < ? ORDER BY started_at LIMIT ?)",
+                (cutoff, batch_size)
+            )
+            count = cursor.rowcount
+        deleted += count
+        if count < batch_size:
+            break
+    if deleted:
+        logger.info(f"已清理 {deleted} 条执行耗时记录")
+    return deleted
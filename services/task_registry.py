@@ -0,0 +1,93 @@
+import threading
+from types import MappingProxyType
+from models.task import load_tasks
+from utils.logger import logger
+
+class TaskRegistry:
+    """进程内任务缓存
+
+    首次访问时从tasks表加载全部任务，之后的读取全部走内存。
+    每次写入都会生成新的快照并整体替换，同时递增版本号，
+    读取方拿到的快照不会被并发写入修改，保证看到的是一致的数据。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = None
+        self._version = 0
+
+    def _load(self):
+        return MappingProxyType({task.id: task for task in load_tasks("ORDER BY id")})
+
+    def _snapshot(self):
+        tasks = self._tasks
+        if tasks is None:
+            with self._lock:
+                if self._tasks is None:
+                    self._tasks = self._load()
+                    self._version += 1
+                    logger.info(f"*** 任务缓存已加载，共 {len(self._tasks)} 个任务")
+                tasks = self._tasks
+        return tasks
+
+    @property
+    def version(self):
+        """当前快照版本号，每次变更后递增"""
+        return self._version
+
+    def snapshot(self):
+        """返回 (版本号, 任务字典)，任务字典不可修改"""
+        while True:
+            self._snapshot()
+            with self._lock:
+                if self._tasks is not None:
+                    return self._version, self._tasks
+
+    def get(self, task_id):
+        """根据ID获取任务"""
+        return self._snapshot().get(task_id)
+
+    def all(self):
+        """获取所有任务，按ID排序"""
+        return list(self._snapshot().values())
+
+    def enabled(self, task_type=None):
+        """获取所有启用的任务，可按类型过滤"""
+        return [task for task in self._snapshot().values()
+                if task.enabled and (task_type is None or task.type == task_type)]
+
+    def refresh(self, task_id):
+        """从数据库重新读取单个任务并更新缓存（写入后调用）"""
+        with self._lock:
+            if self._tasks is None:
+                return
+            # 在锁内读取，避免并发更新时旧数据覆盖新数据
+            rows = load_tasks("WHERE id = ?", (task_id,))
+            tasks = dict(self._tasks)
+            if rows:
+                tasks[task_id] = rows[0]
+            else:
+                tasks.pop(task_id, None)
+            self._tasks = MappingProxyType(dict(sorted(tasks.items())))
+            self._version += 1
+        logger.debug(f"任务缓存已更新: 任务ID {task_id}，版本 {self._version}")
+
+    def remove(self, task_id):
+        """从缓存中移除任务（删除后调用）"""
+        with self._lock:
+            if self._tasks is None or task_id not in self._tasks:
+                return
+            tasks = dict(self._tasks)
+            tasks.pop(task_id, None)
+            self._tasks = MappingProxyType(tasks)
+            self._version += 1
+        logger.debug(f"任务缓存已移除: 任务ID {task_id}，版本 {self._version}")
+
+    def invalidate(self):
+        """清空缓存，下次访问时重新加载"""
+        with self._lock:
+            self._tasks = None
+            self._version += 1
+        logger.info("任务缓存已失效")
+
+task_registry = TaskRegistry()
@@ -1,44 +1,142 @@
-import sqlite3
-from models.db import execute_query
-from services.feishu_service import send_feishu_message
+from models.db import execute_query, transaction
+from models.task import TASK_WRITABLE_FIELDS, TASK_PRESERVED_FIELDS, task_values, decode_json_field
+from services.feishu_service import render_feishu_message
+from services.delivery_queue import delivery_queue
 from services.ai_service import get_ai_news, call_llm
+from services.log_service import add_log
+from services.task_registry import task_registry
+from services.content_cache import content_cache
+from services.run_metrics import RunTimer
+from utils.config import PREGENERATE_LEAD_MINUTES, PREGENERATE_TYPES
 from datetime import datetime
 from utils.logger import logger
 
+_INSERT_TASK_SQL = (
+    f"INSERT INTO tasks ({', '.join(TASK_WRITABLE_FIELDS)}) "
+    f"VALUES ({', '.join('?' * len(TASK_WRITABLE_FIELDS))})"
+)
+
+def _update_task_sql(fields):
+    return (
+        f"UPDATE tasks SET {', '.join(f'{field} = ?' for field in fields)}, "
+        "updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+    )
+
 def get_all_tasks():
     """获取所有任务"""
-    return execute_query("SELECT * FROM tasks")
+    return task_registry.all()
 
 def get_task_by_id(task_id):
     """根据ID获取任务"""
-    logger.info(f"根据ID {task_id} 获取任务")
-    return execute_query("SELECT * FROM tasks WHERE id = ?", (task_id,), fetch_one=True)
+    logger.debug(f"根据ID {task_id} 获取任务")
+    return task_registry.get(task_id)
+
+def get_enabled_tasks(task_type=None):
+    """获取所有启用的任务，可按类型过滤"""
+    return task_registry.enabled(task_type)
 
 def create_task(task_data):
     """创建任务"""
     logger.info(f"创建新任务: {task_data['name']}")
-    conn = sqlite3.connect('feishu_bot.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO tasks (name, type, webhook_url, cron_expression, enabled, content, api_url, api_key, days_of_week, model_name, ai_news_url, gitlab_url, gitlab_token, gitlab_events, gitlab_project) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (task_data['name'], task_data['type'], task_data['webhook_url'], task_data['cron_expression'], 
-             1 if task_data.get('enabled', True) else 0, task_data.get('content'), 
-             task_data.get('api_url'), task_data.get('api_key'), task_data.get('days_of_week', ''),
-             task_data.get('model_name'), task_data.get('ai_news_url'),
-             task_data.get('gitlab_url'), task_data.get('gitlab_token'), task_data.get('gitlab_events', ''),
-             task_data.get('gitlab_project'))
-        )
-        task_id = cursor.lastrowid
-        conn.commit()
+        with transaction() as conn:
+            cursor = conn.execute(_INSERT_TASK_SQL, task_values(task_data))
+            task_id = cursor.lastrowid
+        task_registry.refresh(task_id)
         logger.info(f"成功创建任务，ID: {task_id}")
         return task_id
     except Exception as e:
         logger.error(f"创建任务失败: {str(e)}")
-        conn.rollback()
         raise
-    finally:
-        conn.close()
+
+TASK_TYPES = ('custom', 'ai_news', 'llm', 'gitlab', 'github')
+MAX_JITTER_SECONDS = 3600
+MAX_COALESCE_SECONDS = 600
+MAX_LLM_DEADLINE_SECONDS = 3600
+MAX_LLM_TOKENS = 100000
+MAX_LLM_FALLBACKS = 4
+
+def validate_task_data(task_data):
+    """校验任务数据，返回错误信息列表，为空表示校验通过"""
+    if not isinstance(task_data, dict):
+        return ["任务数据必须是JSON对象"]
+    errors = []
+    for field in ('name', 'type', 'webhook_url', 'cron_expression'):
+        if not task_data.get(field):
+            errors.append(f"缺少必填字段: {field}")
+    if task_data.get('type') and task_data['type'] not in TASK_TYPES:
+        errors.append(f"未知任务类型: {task_data['type']}")
+    cron_expression = task_data.get('cron_expression')
+    if cron_expression:
+        try:
+            datetime.strptime(str(cron_expression), '%H:%M:%S')
+        except ValueError:
+            errors.append(f"无效的cron表达式: {cron_expression}，格式应为HH:MM:SS")
+    days_of_week = task_data.get('days_of_week')
+    if days_of_week:
+        days = str(days_of_week).split(',')
+        if not all(day.isdigit() and 0 <= int(day) <= 6 for day in days):
+            errors.append(f"无效的days_of_week: {days_of_week}，应为0-6的逗号分隔列表")
+    jitter_seconds = task_data.get('jitter_seconds')
+    if jitter_seconds not in (None, ''):
+        if not isinstance(jitter_seconds, int) or not 0 <= jitter_seconds <= MAX_JITTER_SECONDS:
+            errors.append(f"无效的jitter_seconds: {jitter_seconds}，应为0-{MAX_JITTER_SECONDS}的整数")
+    coalesce_seconds = task_data.get('coalesce_seconds')
+    if coalesce_seconds not in (None, ''):
+        if not isinstance(coalesce_seconds, int) or not 0 <= coalesce_seconds <= MAX_COALESCE_SECONDS:
+            errors.append(f"无效的coalesce_seconds: {coalesce_seconds}，应为0-{MAX_COALESCE_SECONDS}的整数")
+    for field, maximum in (('llm_deadline_seconds', MAX_LLM_DEADLINE_SECONDS), ('llm_max_tokens', MAX_LLM_TOKENS)):
+        value = task_data.get(field)
+        if value not in (None, '') and (not isinstance(value, int) or not 0 <= value <= maximum):
+            errors.append(f"无效的{field}: {value}，应为0-{maximum}的整数")
+    errors.extend(_validate_llm_fallbacks(task_data.get('llm_fallbacks'), task_data.get('api_url')))
+    return errors
+
+def _validate_llm_fallbacks(fallbacks, api_url=None):
+    if fallbacks in (None, '', []):
+        return []
+    if isinstance(fallbacks, str):
+        fallbacks = decode_json_field(fallbacks)
+    if not isinstance(fallbacks, list) or len(fallbacks) > MAX_LLM_FALLBACKS:
+        return [f"无效的llm_fallbacks，应为最多{MAX_LLM_FALLBACKS}项的列表"]
+    errors = []
+    for index, fallback in enumerate(fallbacks):
+        if (not isinstance(fallback, dict) or not (fallback.get('api_url') or fallback.get('model_name'))
+                or not all(isinstance(value, str) for value in fallback.values())):
+            errors.append(f"无效的llm_fallbacks[{index}]，应为包含api_url、api_key、model_name字符串的对象")
+        elif fallback.get('api_url') and fallback['api_url'] != api_url and not fallback.get('api_key'):
+            # 其他服务商不会沿用任务的API Key，缺少时该备用项每次调用都会失败
+            errors.append(f"llm_fallbacks[{index}]的api_url与任务不同，必须填写api_key")
+    return errors
+
+def validate_tasks(tasks_data):
+    """批量校验任务数据，返回 [{'index': 序号, 'errors': [...]}]"""
+    result = []
+    for index, task_data in enumerate(tasks_data):
+        errors = validate_task_data(task_data)
+        if errors:
+            result.append({'index': index, 'errors': errors})
+    return result
+
+def bulk_create_tasks(tasks_data):
+    """在一个事务中批量创建任务，返回新任务ID列表
+
+    调用前需先通过validate_tasks校验，任意一条写入失败时全部回滚。
+    """
+    logger.info(f"批量创建 {len(tasks_data)} 个任务")
+    task_ids = []
+    try:
+        with transaction() as conn:
+            for task_data in tasks_data:
+                cursor = conn.execute(_INSERT_TASK_SQL, task_values(task_data))
+                task_ids.append(cursor.lastrowid)
+    except Exception as e:
+        logger.error(f"批量创建任务失败: {str(e)}")
+        raise
+    # 批量写入后整体重新加载一次缓存
+    task_registry.invalidate()
+    logger.info(f"成功批量创建 {len(task_ids)} 个任务")
+    return task_ids
 
 def update_task(task_id, task_data):
     """更新任务"""
@@ -50,35 +148,74 @@ def update_task(task_id, task_data):
             commit=True
         )
     else:
-        # 完整更新所有字段
-        execute_query(
-            "UPDATE tasks SET name = ?, type = ?, webhook_url = ?, cron_expression = ?, enabled = ?, content = ?, api_url = ?, api_key = ?, days_of_week = ?, model_name = ?, ai_news_url = ?, gitlab_url = ?, gitlab_token = ?, gitlab_events = ?, gitlab_project = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (task_data['name'], task_data['type'], task_data['webhook_url'], task_data['cron_expression'], 
-             1 if task_data.get('enabled', True) else 0, task_data.get('content'), 
-             task_data.get('api_url'), task_data.get('api_key'), task_data.get('days_of_week', ''),
-             task_data.get('model_name'), task_data.get('ai_news_url'),
-             task_data.get('gitlab_url'), task_data.get('gitlab_token'), task_data.get('gitlab_events', ''),
-             task_data.get('gitlab_project'), task_id),
-            commit=True
-        )
+        # 完整更新所有字段，仅能通过接口设置的字段未提供时保留原值
+        fields = [field for field in TASK_WRITABLE_FIELDS
+                  if field not in TASK_PRESERVED_FIELDS or field in task_data]
+        execute_query(_update_task_sql(fields), task_values(task_data, fields) + (task_id,), commit=True)
+    task_registry.refresh(task_id)
+    content_cache.discard(task_id)
 
 def delete_task(task_id):
     """删除任务"""
-    execute_query("DELETE FROM ta sks WHERE id = ?", (task_id,), commit=True)
+    execute_query("DELETE FROM tasks WHERE id = ?", (task_id,), commit=True)
+    task_registry.remove(task_id)
+    content_cache.discard(task_id)
+
+def generate_content(task):
+    """根据任务类型生成消息内容，返回 (是否成功, 内容或错误信息)"""
+    if task.type == 'custom':
+        return True, task.content
+    elif task.type == 'ai_news':
+        # 如果有自定义的AI新闻URL，则使用它，否则使用默认值
+        return get_ai_news(task.ai_news_url) if task.ai_news_url else get_ai_news()
+    elif task.type == 'llm':
+        # 如果有自定义的模型名称，则使用它，否则使用默认值；配置了备用服务商/模型时按顺序对冲和故障切换
+        return call_llm(task.api_url, task.api_key, task.content, task.model_name,
+                        max_tokens=task.llm_max_tokens, deadline=task.llm_deadline_seconds,
+                        fallbacks=decode_json_field(task.llm_fallbacks))
+    elif task.type == 'gitlab':
+        # GitLab任务类型不需要在这里执行，它是由Webhook触发的
+        return True, "GitLab任务是由Webhook触发的，不需要定时执行"
+    return False, f"未知任务类型: {task.type}"
+
+def pregenerate_content(task_id, fire_time):
+    """提前生成任务内容并缓存，fire_time为目标触发时间的时间戳"""
+    task = get_task_by_id(task_id)
+    if not task or not task.enabled or task.type not in PREGENERATE_TYPES:
+        return
+    try:
+        success, message = generate_content(task)
+    except Exception as e:
+        success, message = False, str(e)
+    if success:
+        content_cache.put(task_id, fire_time, message)
+        logger.info(f"任务 '{task.name}' 内容已预生成")
+    else:
+        # 预生成失败不记录执行日志，到触发时间会重新实时生成
+        logger.warning(f"任务 '{task.name}' 内容预生成失败，将在触发时实时生成: {message}")
+
+def _finish_task_run(task_id, name, timer, send_success, send_msg, elapsed):
+    """消息发送完成后记录任务日志和各阶段耗时（在发送线程中调用）"""
+    timer.add('send', elapsed)
+    if send_success:
+        log_status = "成功"
+        log_message = f"任务 '{name}' 执行成功"
+    else:
+        log_status = "失败"
+        log_message = send_msg
+    add_log(task_id, log_status, log_message)
+    timer.record(log_status)
 
 def execute_task(task_id):
     """执行任务"""
     task = get_task_by_id(task_id)
     
-    if not task or task[5] == 0:  # 任务不存在或已禁用
+    if not task or not task.enabled:  # 任务不存在或已禁用
         return
     
-    # 确保task元组有足够的元素
-    task_data = list(task)
-    while len(task_data) < 18:  # 确保至少有18个元素（包含新增的GitLab相关字段）
-        task_data.append(None)
-    
-    task_id, name, type, webhook_url, cron_expression, enabled, created_at, updated_at, content, api_url, api_key, days_of_week, model_name, ai_news_url, gitlab_url, gitlab_token, gitlab_events, gitlab_project = task_data
+    name, type, webhook_url = task.name, task.type, task.webhook_url
+    days_of_week = task.days_of_week
+    timer = RunTimer(task_id)
     
     try:
         # 检查是否是指定的星期几
@@ -94,40 +231,33 @@ def execute_task(task_id):
                 # 不是指定的星期几，不执行任务
                 return
         
-        # 根据任务类型生成内容
-        if type == 'custom':
-            success, message = True, content
-        elif type == 'ai_news':
-            # 如果有自定义的AI新闻URL，则使用它，否则使用默认值
-            success, message = get_ai_news(ai_news_url if ai_news_url else None)
-        elif type == 'llm':
-            # 如果有自定义的模型名称，则使用它，否则使用默认值
-            success, message = call_llm(api_url, api_key, content, model_name)
-        elif type == 'gitlab':
-            # GitLab任务类型不需要在这里执行，它是由Webhook触发的
-            success, message = True, "GitLab任务是由Webhook触发的，不需要定时执行"
-        else:
-            success, message = False, f"未知任务类型: {type}"
+        # 开启预生成时优先使用提前生成的内容，没有或已过期时实时生成
+        with timer.phase('generate'):
+            pregenerated = PREGENERATE_LEAD_MINUTES > 0 and type in PREGENERATE_TYPES
+            message = content_cache.take(task_id) if pregenerated else None
+            if message is not None:
+                success = True
+                logger.info(f"任务 '{name}' 使用预生成内容")
+            else:
+                success, message = generate_content(task)
         
-        # 发送消息
+        # 发送消息：放入发送队列后立即返回，发送完成后记录日志
         if success:
-            send_success, send_msg = send_feishu_message(webhook_url, message)
-            if send_success:
-                log_status = "成功"
-                log_message = f"任务 '{name}' 执行成功"
-            else:
-                log_status = "失败"
-                log_message = send_msg
-        else:
-            log_status = "失败"
-            log_message = message
+            logger.info(f"发送飞书消息到: {webhook_url}")
+            with timer.phase('render'):
+                body = render_feishu_message(message)
+            delivery_queue.enqueue(
+                webhook_url, body,
+                lambda send_success, send_msg, elapsed: _finish_task_run(task_id, name, timer, send_success, send_msg, elapsed),
+                task_id
+            )
+            return
+        log_status = "失败"
+        log_message = message
     except Exception as e:
         log_status = "失败"
         log_message = f"任务执行异常: {str(e)}"
     
-    # 记录日志
-    execute_query(
-        "INSERT INTO logs (task_id, status, message) VALUES (?, ?, ?)",
-        (task_id, log_status, log_message),
-        commit=True
-    )
+    # 记录日志和各阶段耗时
+    add_log(task_id, log_status, log_message)
+    timer.record(log_status)
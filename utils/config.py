@@ -0,0 +1,188 @@
+import os
+import socket
+
+# 所有配置均可通过环境变量覆盖，未设置时使用默认值
+
+def _env_str(name, default):
+    return os.environ.get(name, default)
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+def _env_int_map(name, default):
+    """解析 key=value,key=value 格式的配置，值为整数"""
+    value = os.environ.get(name)
+    result = dict(default)
+    if not value:
+        return result
+    for item in value.split(','):
+        key, sep, number = item.partition('=')
+        if not sep:
+            continue
+        try:
+            result[key.strip()] = int(number)
+        except ValueError:
+            continue
+    return result
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# 数据库配置
+DATABASE_NAME = _env_str('ACBOT_DATABASE', 'feishu_bot.db')
+DB_POOL_SIZE = _env_int('ACBOT_DB_POOL_SIZE', 8)  # 连接池最大连接数
+DB_POOL_TIMEOUT = _env_float('ACBOT_DB_POOL_TIMEOUT', 10.0)  # 获取连接的最长等待时间（秒）
+DB_BUSY_TIMEOUT = _env_int('ACBOT_DB_BUSY_TIMEOUT', 5000)  # SQLite忙等待超时（毫秒）
+DB_SYNCHRONOUS = _env_str('ACBOT_DB_SYNCHRONOUS', 'NORMAL').upper()  # OFF / NORMAL / FULL / EXTRA
+
+# 日志写入配置
+LOG_WRITER_BATCH_SIZE = _env_int('ACBOT_LOG_BATCH_SIZE', 200)  # 单次批量写入的最大日志条数
+LOG_WRITER_FLUSH_INTERVAL = _env_float('ACBOT_LOG_FLUSH_INTERVAL', 1.0)  # 日志最长缓冲时间（秒）
+
+# 日志保留配置
+LOG_RETENTION_DAYS = _env_int('ACBOT_LOG_RETENTION_DAYS', 30)  # 日志保留天数，0表示不按时间清理
+LOG_RETENTION_MAX_ROWS = _env_int('ACBOT_LOG_RETENTION_MAX_ROWS', 1000000)  # 日志表最大行数，0表示不限制
+LOG_RETENTION_BATCH_SIZE = _env_int('ACBOT_LOG_RETENTION_BATCH_SIZE', 1000)  # 每批删除的日志条数
+LOG_RETENTION_INTERVAL_MINUTES = _env_int('ACBOT_LOG_RETENTION_INTERVAL', 60)  # 清理间隔（分钟），0表示不自动清理
+LOG_ARCHIVE_DIR = _env_str('ACBOT_LOG_ARCHIVE_DIR', os.path.join('logs', 'archive'))  # 归档目录，为空表示删除前不归档
+LOG_VACUUM_PAGES = _env_int('ACBOT_LOG_VACUUM_PAGES', 0)  # 每次增量VACUUM回收的页数，0表示全部回收
+LOG_VACUUM_INTERVAL_HOURS = _env_int('ACBOT_LOG_VACUUM_INTERVAL', 0)  # 整库VACUUM间隔（小时），执行期间阻塞写入，0表示不执行
+
+# 调度器配置
+SCHEDULER_JOBSTORE = _env_str('ACBOT_SCHEDULER_JOBSTORE', 'memory').lower()  # memory / sqlite
+# 各任务类型错过触发后的补偿执行窗口（秒），0表示不补偿
+SCHEDULER_MISFIRE_GRACE = _env_int_map('ACBOT_SCHEDULER_MISFIRE_GRACE', {
+    'custom': 300,
+    'ai_news': 300,
+    'llm': 300,
+})
+SCHEDULER_MISFIRE_GRACE_DEFAULT = _env_int('ACBOT_SCHEDULER_MISFIRE_GRACE_DEFAULT', 300)
+# 调度线程池：default池执行维护任务和未单独配置的任务类型，其余任务类型各自使用独立线程池
+SCHEDULER_POOL_SIZE = _env_int('ACBOT_SCHEDULER_POOL_SIZE', 10)
+SCHEDULER_TYPE_POOL_SIZES = _env_int_map('ACBOT_SCHEDULER_TYPE_POOLS', {
+    'llm': 5,
+    'ai_news': 3,
+    'custom': 5,
+})
+SCHEDULER_COALESCE = _env_bool('ACBOT_SCHEDULER_COALESCE', True)  # 多次错过的触发合并为一次执行
+# 同一任务允许同时运行的实例数
+SCHEDULER_MAX_INSTANCES = _env_int_map('ACBOT_SCHEDULER_MAX_INSTANCES', {})
+SCHEDULER_MAX_INSTANCES_DEFAULT = _env_int('ACBOT_SCHEDULER_MAX_INSTANCES_DEFAULT', 1)
+# 开启触发时间分散（jitter_seconds > 0）的任务会在窗口内错开触发，每秒最多触发的任务数，0表示不限制
+SCHEDULER_MAX_FIRES_PER_SECOND = _env_int('ACBOT_SCHEDULER_MAX_FIRES_PER_SECOND', 0)
+
+# 内容预生成配置：大模型和AI新闻任务提前生成内容，到触发时间只负责发送
+PREGENERATE_LEAD_MINUTES = _env_int('ACBOT_PREGENERATE_LEAD_MINUTES', 0)  # 提前生成的分钟数，0表示不预生成
+PREGENERATE_TYPES = tuple(t.strip() for t in _env_str('ACBOT_PREGENERATE_TYPES', 'llm,ai_news').split(',') if t.strip())
+PREGENERATE_EARLY_SECONDS = _env_int('ACBOT_PREGENERATE_EARLY_SECONDS', 5)  # 早于目标触发时间多少秒内仍可使用预生成内容
+PREGENERATE_MAX_LATE_SECONDS = _env_int('ACBOT_PREGENERATE_MAX_LATE_SECONDS', 300)  # 晚于目标触发时间超过该秒数后预生成内容过期
+
+# 集群配置：多个实例共享同一个数据库时，按任务ID将任务分配给存活的节点
+CLUSTER_ENABLED = _env_bool('ACBOT_CLUSTER_ENABLED', False)
+CLUSTER_NODE_ID = _env_str('ACBOT_CLUSTER_NODE_ID', '') or f"{socket.gethostname()}-{os.getpid()}"  # 节点ID，默认为 主机名-进程号
+CLUSTER_HEARTBEAT_SECONDS = _env_float('ACBOT_CLUSTER_HEARTBEAT_SECONDS', 2.0)
+CLUSTER_LEASE_SECONDS = _env_float('ACBOT_CLUSTER_LEASE_SECONDS', 6.0)  # 超过该时间未心跳的节点视为下线
+
+# 任务执行耗时统计配置
+RUN_METRICS_RETENTION_DAYS = _env_int('ACBOT_RUN_METRICS_RETENTION_DAYS', 30)  # 执行耗时记录保留天数，0表示不清理
+RUN_METRICS_WINDOW_HOURS = _env_int('ACBOT_RUN_METRICS_WINDOW_HOURS', 24)  # 统计接口默认统计最近多少小时
+
+# 飞书消息发送配置：共享连接池，复用TCP/TLS连接
+FEISHU_CONNECT_TIMEOUT = _env_float('ACBOT_FEISHU_CONNECT_TIMEOUT', 3.0)  # 建立连接超时（秒）
+FEISHU_READ_TIMEOUT = _env_float('ACBOT_FEISHU_READ_TIMEOUT', 10.0)  # 等待响应超时（秒）
+FEISHU_POOL_HOSTS = _env_int('ACBOT_FEISHU_POOL_HOSTS', 10)  # 连接池缓存的主机数
+FEISHU_POOL_MAXSIZE = _env_int('ACBOT_FEISHU_POOL_MAXSIZE', 20)  # 每个主机保持的最大连接数
+
+# 异步消息发送配置
+DELIVERY_WORKERS = _env_int('ACBOT_DELIVERY_WORKERS', 8)  # 并发发送线程数
+DELIVERY_QUEUE_SIZE = _env_int('ACBOT_DELIVERY_QUEUE_SIZE', 10000)  # 待发送队列上限，超出时直接记为失败
+
+def _env_rate_limits(name, default):
+    """解析 次数/秒数,次数/秒数 格式的限流配置，例如 5/1,100/60"""
+    value = os.environ.get(name)
+    if value is None:
+        value = default
+    limits = []
+    for item in value.split(','):
+        count, sep, period = item.partition('/')
+        try:
+            if sep and int(count) > 0 and float(period) > 0:
+                limits.append((int(count), float(period)))
+        except ValueError:
+            continue
+    return tuple(limits)
+
+# 飞书机器人限流配置：按webhook分别限流，超出时排队平滑发送
+FEISHU_RATE_LIMITS = _env_rate_limits('ACBOT_FEISHU_RATE_LIMITS', '5/1,100/60')  # 每个webhook的发送频率上限，为空表示不限流
+FEISHU_RATE_LIMIT_CODES = tuple(int(code) for code in _env_str('ACBOT_FEISHU_RATE_LIMIT_CODES', '9499,11232').split(',')
+                                if code.strip().isdigit())  # 飞书返回的限流错误码
+FEISHU_RATE_LIMIT_BACKOFF = _env_float('ACBOT_FEISHU_RATE_LIMIT_BACKOFF', 1.0)  # 被限流后暂停发送的初始秒数，连续被限流时翻倍
+FEISHU_RATE_LIMIT_MAX_BACKOFF = _env_float('ACBOT_FEISHU_RATE_LIMIT_MAX_BACKOFF', 60.0)
+FEISHU_RATE_LIMIT_RETRIES = max(0, _env_int('ACBOT_FEISHU_RATE_LIMIT_RETRIES', 5))  # 被限流后最多重发次数，负数按0处理
+
+# 待发送消息持久化（outbox）配置：发送失败后按指数退避重试，超过次数后转为死信
+OUTBOX_MAX_ATTEMPTS = _env_int('ACBOT_OUTBOX_MAX_ATTEMPTS', 8)  # 最多发送次数
+OUTBOX_BACKOFF_BASE = _env_float('ACBOT_OUTBOX_BACKOFF_BASE', 2.0)  # 首次重试的基础等待秒数，之后每次翻倍
+OUTBOX_BACKOFF_MAX = _env_float('ACBOT_OUTBOX_BACKOFF_MAX', 600.0)  # 重试等待上限（秒）
+OUTBOX_FLUSH_INTERVAL = _env_float('ACBOT_OUTBOX_FLUSH_INTERVAL', 0.2)  # 消息状态最长缓冲时间（秒），崩溃时最多丢失这段时间内入队的消息
+OUTBOX_RECOVERY_INTERVAL_SECONDS = _env_int('ACBOT_OUTBOX_RECOVERY_INTERVAL', 60)  # 接管已下线节点未发送消息的检查间隔，0表示只在启动时恢复
+OUTBOX_RETENTION_DAYS = _env_int('ACBOT_OUTBOX_RETENTION_DAYS', 7)  # 已发送和死信消息保留天数，0表示不清理
+
+# Git事件合并配置：开启合并窗口（coalesce_seconds > 0）的任务，短时间内的多次推送合并为一条汇总消息
+GIT_COALESCE_MAX_DELAY_SECONDS = _env_int('ACBOT_GIT_COALESCE_MAX_DELAY', 60)  # 从第一个事件到发送汇总的最长等待时间（秒）
+GIT_COALESCE_TOP_COMMITS = _env_int('ACBOT_GIT_COALESCE_TOP_COMMITS', 5)  # 汇总消息中展示的最新提交数
+
+# 大模型客户端配置：按 (API地址, API Key) 缓存客户端，复用连接池和TLS会话
+LLM_CLIENT_CACHE_SIZE = _env_int('ACBOT_LLM_CLIENT_CACHE_SIZE', 16)  # 最多缓存的客户端数，超出时关闭最久未使用的
+LLM_CONNECT_TIMEOUT = _env_float('ACBOT_LLM_CONNECT_TIMEOUT', 5.0)  # 建立连接超时（秒）
+LLM_TIMEOUT = _env_float('ACBOT_LLM_TIMEOUT', 120.0)  # 单次请求超时（秒）
+LLM_MAX_RETRIES = _env_int('ACBOT_LLM_MAX_RETRIES', 2)  # 连接错误、限流和服务端错误的自动重试次数
+# 按API主机名单独配置，例如 api.deepseek.com=180,api.openai.com=60
+LLM_PROVIDER_TIMEOUTS = _env_int_map('ACBOT_LLM_PROVIDER_TIMEOUTS', {})
+LLM_PROVIDER_RETRIES = _env_int_map('ACBOT_LLM_PROVIDER_RETRIES', {})
+
+# 大模型回复缓存配置：相同服务商、模型和提示词的请求共用一次调用结果
+LLM_CACHE_TTL_SECONDS = _env_int('ACBOT_LLM_CACHE_TTL', 0)  # 回复缓存时间（秒），0表示不缓存
+LLM_CACHE_SIZE = _env_int('ACBOT_LLM_CACHE_SIZE', 256)  # 最多缓存的回复数
+LLM_CACHE_BUCKET_SECONDS = _env_int('ACBOT_LLM_CACHE_BUCKET', 3600)  # 按时间段区分缓存（秒），不同时间段的相同提示词重新生成，0表示不区分
+
+# 大模型流式生成配置：逐段接收回复，超过截止时间时停止生成
+LLM_STREAM = _env_bool('ACBOT_LLM_STREAM', False)  # 是否使用流式生成
+LLM_STREAM_USAGE = _env_bool('ACBOT_LLM_STREAM_USAGE', True)  # 流式生成时请求服务商在最后一段返回token用量，不支持stream_options的服务商需关闭
+LLM_DEADLINE_SECONDS = _env_int('ACBOT_LLM_DEADLINE', 0)  # 任务未单独设置时的生成截止时间（秒），0表示只使用请求超时
+LLM_MAX_TOKENS = _env_int('ACBOT_LLM_MAX_TOKENS', 0)  # 任务未单独设置时的最大输出token数，0表示使用服务商默认值
+LLM_DEADLINE_PARTIAL = _env_bool('ACBOT_LLM_DEADLINE_PARTIAL', True)  # 流式生成超时时发送已生成的内容，否则视为失败
+LLM_METRICS_SAMPLES = _env_int('ACBOT_LLM_METRICS_SAMPLES', 500)  # 每个模型保留的最近调用耗时样本数
+
+# 大模型并发和频率控制：按API地址排队调用，避免同时触发的任务一起请求导致被限流
+LLM_MAX_CONCURRENCY = _env_int('ACBOT_LLM_MAX_CONCURRENCY', 4)  # 每个API地址同时进行的最大请求数，0表示不限制
+LLM_RPM = _env_int('ACBOT_LLM_RPM', 60)  # 每个API地址每分钟最多请求数，0表示不限制
+# 按API主机名单独配置，例如 api.deepseek.com=8
+LLM_PROVIDER_CONCURRENCY = _env_int_map('ACBOT_LLM_PROVIDER_CONCURRENCY', {})
+LLM_PROVIDER_RPM = _env_int_map('ACBOT_LLM_PROVIDER_RPM', {})
+LLM_QUEUE_TIMEOUT = _env_float('ACBOT_LLM_QUEUE_TIMEOUT', 120.0)  # 排队等待的最长时间（秒），超时视为调用失败
+LLM_BACKOFF = _env_float('ACBOT_LLM_BACKOFF', 2.0)  # 收到429或5xx后暂停请求的初始秒数，连续出现时翻倍
+LLM_MAX_BACKOFF = _env_float('ACBOT_LLM_MAX_BACKOFF', 60.0)
+
+# 大模型对冲请求配置：任务配置了备用服务商/模型（llm_fallbacks）时生效
+LLM_HEDGE = _env_bool('ACBOT_LLM_HEDGE', True)  # 当前请求超过该模型p95耗时仍未返回时同时请求下一个候选，关闭后只在出错时切换
+LLM_HEDGE_DELAY = _env_float('ACBOT_LLM_HEDGE_DELAY', 30.0)  # 耗时样本不足时发起对冲请求的等待秒数
+LLM_HEDGE_MIN_SAMPLES = _env_int('ACBOT_LLM_HEDGE_MIN_SAMPLES', 20)  # 使用p95耗时所需的最少样本数
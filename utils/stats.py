@@ -0,0 +1,8 @@
+import math
+
+def percentile(sorted_values, p):
+    """计算已排序序列的百分位数（最近秩法），序列为空时返回0"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]